@@ -1,5 +1,7 @@
+import time
 import asyncpg
 from contextlib import asynccontextmanager
+from app.metrics import InstrumentedConnection, record_pool_wait
 
 class Database:
     def __init__(self):
@@ -10,7 +12,8 @@ class Database:
             dsn=dsn,
             min_size=3,
             max_size=15,
-            command_timeout=30
+            command_timeout=30,
+            connection_class=InstrumentedConnection
         )
     
     async def disconnect(self):
@@ -22,7 +25,9 @@ class Database:
         if not self.pool:
             raise RuntimeError("Database not connected")
         
+        started = time.perf_counter()
         async with self.pool.acquire() as conn:
+            record_pool_wait(time.perf_counter() - started)
             try:
                 yield conn
             finally:
@@ -0,0 +1,361 @@
+"""
+Помесячное секционирование flights и flight_features по plan_departure.
+
+    python -m DB.partitions migrate --batch-size 50000
+    python -m DB.partitions ensure --months-ahead 3
+    python -m DB.partitions feature-key --batch-size 50000
+"""
+import argparse
+import asyncio
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional
+import asyncpg
+from dotenv import load_dotenv
+from app.features import derive_flight_features
+
+load_dotenv()
+
+PARTITIONED_TABLES = ("flights", "flight_features")
+MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(start: date, end: date) -> List[date]:
+    months = []
+    current = month_start(start)
+    while current <= end:
+        months.append(current)
+        current = add_months(current, 1)
+    return months
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def _bound(month: date) -> str:
+    # Границы секций — в UTC, чтобы не зависеть от TimeZone сессии
+    return f"{month.isoformat()} 00:00:00+00"
+
+
+async def is_partitioned(conn, table: str) -> bool:
+    return await conn.fetchval(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = $1 AND pg_table_is_visible(c.oid)
+        )
+        """,
+        table
+    )
+
+
+async def create_partition(conn, table: str, month: date, parent: Optional[str] = None) -> Optional[str]:
+    """Секция за месяц; parent — другое имя родителя (во время миграции)"""
+    name = partition_name(table, month)
+    try:
+        await conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {name}
+            PARTITION OF {parent or table}
+            FOR VALUES FROM ('{_bound(month)}') TO ('{_bound(add_months(month, 1))}')
+            """
+        )
+        return name
+    except asyncpg.PostgresError as e:
+        # Например, в DEFAULT-секции уже есть строки за этот месяц
+        print(f"Error in create_partition {name}: {e}")
+        return None
+
+
+async def create_default_partition(conn, table: str, parent: Optional[str] = None):
+    await conn.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {parent or table} DEFAULT")
+
+
+async def ensure_partitions(conn, table: str, start: date, end: date) -> List[str]:
+    created = []
+    for month in months_between(start, end):
+        name = await create_partition(conn, table, month)
+        if name:
+            created.append(name)
+    return created
+
+
+async def ensure_future_partitions(conn, months_ahead: int = MONTHS_AHEAD) -> List[str]:
+    """Создаёт секции с текущего месяца на months_ahead вперёд для уже секционированных таблиц"""
+    today = month_start(datetime.now(timezone.utc))
+    created = []
+    for table in PARTITIONED_TABLES:
+        if await is_partitioned(conn, table):
+            created += await ensure_partitions(conn, table, today, add_months(today, months_ahead))
+    return created
+
+
+async def maintain_partitions(pool, interval: float = 24 * 3600):
+    """Фоновая задача: раз в сутки досоздаёт будущие секции"""
+    while True:
+        try:
+            async with pool.acquire() as conn:
+                await ensure_future_partitions(conn)
+        except Exception as e:
+            print(f"Error in maintain_partitions: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _columns(conn, table: str) -> List[str]:
+    rows = await conn.fetch(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = $1 AND table_schema = current_schema()
+        ORDER BY ordinal_position
+        """,
+        table
+    )
+    return [r["column_name"] for r in rows]
+
+
+async def _copy_batches(conn, insert_sql: str, key_from: int, key_to: int, batch_size: int, label: str) -> int:
+    last = key_from
+    while last < key_to:
+        upper = min(last + batch_size, key_to)
+        result = await conn.execute(insert_sql, last, upper)
+        print(f"{label}: id {last + 1}..{upper}, {result.split()[-1]} строк")
+        last = upper
+    return last
+
+
+async def feature_key_ready(conn) -> bool:
+    """
+    flight_features.plan_departure есть и заполнен. NOT NULL ставит add_feature_key после
+    заполнения (у секционированной таблицы он задан при миграции), поэтому хватает каталога.
+    """
+    return await conn.fetchval(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'flight_features'
+            AND column_name = 'plan_departure' AND is_nullable = 'NO'
+        )
+        """
+    )
+
+
+async def add_feature_key(conn, batch_size: int = 50_000):
+    """
+    Добавляет flight_features.plan_departure и заполняет его из flights: строки с NULL
+    выпали бы из соединений по ключу секционирования и из удаления по диапазону в backfill.
+    """
+    if await feature_key_ready(conn):
+        return
+    if "plan_departure" not in await _columns(conn, "flight_features"):
+        await conn.execute("ALTER TABLE flight_features ADD COLUMN plan_departure TIMESTAMPTZ")
+    max_id = await conn.fetchval("SELECT COALESCE(MAX(flight_id), 0) FROM flight_features")
+    await _copy_batches(conn, """
+        UPDATE flight_features ff
+        SET plan_departure = f.plan_departure
+        FROM flights f
+        WHERE f.id = ff.flight_id
+        AND ff.flight_id > $1 AND ff.flight_id <= $2
+        AND ff.plan_departure IS NULL
+    """, 0, max_id, batch_size, "flight_features.plan_departure")
+    # Признаки удалённых рейсов заполнить нечем
+    orphans = await conn.execute("""
+        DELETE FROM flight_features ff
+        WHERE ff.plan_departure IS NULL
+        AND NOT EXISTS (SELECT 1 FROM flights f WHERE f.id = ff.flight_id)
+    """)
+    print(f"flight_features без рейса удалено: {orphans.split()[-1]}")
+
+    # CHECK ... NOT VALID проверяется без блокировки записи, а SET NOT NULL использует его
+    # вместо повторного сканирования таблицы под ACCESS EXCLUSIVE
+    await conn.execute("""
+        ALTER TABLE flight_features DROP CONSTRAINT IF EXISTS flight_features_plan_departure_not_null;
+        ALTER TABLE flight_features ADD CONSTRAINT flight_features_plan_departure_not_null
+            CHECK (plan_departure IS NOT NULL) NOT VALID;
+    """)
+    await conn.execute("ALTER TABLE flight_features VALIDATE CONSTRAINT flight_features_plan_departure_not_null")
+    await conn.execute("""
+        ALTER TABLE flight_features ALTER COLUMN plan_departure SET NOT NULL;
+        ALTER TABLE flight_features DROP CONSTRAINT flight_features_plan_departure_not_null;
+    """)
+
+
+_INDEX_DEF = re.compile(r"CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (USING .*)")
+
+
+async def _copy_indexes(conn, table: str, target: str):
+    """Повторяет на секционированной таблице все индексы исходной, кроме первичного ключа"""
+    rows = await conn.fetch(
+        """
+        SELECT i.relname AS name, pg_get_indexdef(ix.indexrelid) AS definition,
+               ix.indisprimary AS is_primary, ix.indisunique AS is_unique
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        WHERE ix.indrelid = $1::regclass
+        """,
+        table
+    )
+    for row in rows:
+        if row["is_primary"]:
+            continue
+        match = _INDEX_DEF.match(row["definition"])
+        if not match:
+            print(f"Индекс {row['name']} пропущен: не удалось разобрать определение")
+            continue
+        if row["is_unique"] and "plan_departure" not in match.group(2):
+            print(f"Уникальный индекс {row['name']} пропущен: он не содержит ключ секционирования")
+            continue
+        suffix = row["name"][len(table) + 1:] if row["name"].startswith(f"{table}_") else row["name"]
+        await conn.execute(
+            f"CREATE {match.group(1) or ''}INDEX IF NOT EXISTS {target}_{suffix} ON {target} {match.group(2)}"
+        )
+
+
+async def migrate(dsn: str, batch_size: int = 50_000, months_ahead: int = MONTHS_AHEAD):
+    """Переносит flights и flight_features в секционированные таблицы пачками и подменяет их"""
+    conn = await asyncpg.connect(dsn)
+    try:
+        if await is_partitioned(conn, "flights"):
+            print("flights уже секционирована")
+            return
+
+        await add_feature_key(conn, batch_size)
+
+        bounds = await conn.fetchrow("SELECT MIN(plan_departure) AS lo, MAX(plan_departure) AS hi FROM flights")
+        now = datetime.now(timezone.utc)
+        first = month_start(bounds["lo"] or now)
+        last = add_months(month_start(max(bounds["hi"] or now, now)), months_ahead)
+
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS flights_partitioned (LIKE flights INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY RANGE (plan_departure);
+            ALTER TABLE flights_partitioned ADD PRIMARY KEY (id, plan_departure);
+
+            CREATE TABLE IF NOT EXISTS flight_features_partitioned (LIKE flight_features INCLUDING DEFAULTS)
+            PARTITION BY RANGE (plan_departure);
+            ALTER TABLE flight_features_partitioned ALTER COLUMN plan_departure SET NOT NULL;
+            CREATE UNIQUE INDEX IF NOT EXISTS flight_features_partitioned_flight_idx
+                ON flight_features_partitioned (flight_id, plan_departure);
+        """)
+        for table in PARTITIONED_TABLES:
+            await _copy_indexes(conn, table, f"{table}_partitioned")
+        for table in PARTITIONED_TABLES:
+            for month in months_between(first, last):
+                await create_partition(conn, table, month, parent=f"{table}_partitioned")
+            await create_default_partition(conn, table, parent=f"{table}_partitioned")
+
+        feature_columns = await _columns(conn, "flight_features")
+        feature_select = ", ".join(
+            "f.plan_departure" if column == "plan_departure" else f"ff.{column}"
+            for column in feature_columns
+        )
+        copy_flights = """
+            INSERT INTO flights_partitioned
+            SELECT * FROM flights WHERE id > $1 AND id <= $2
+        """
+        copy_features = f"""
+            INSERT INTO flight_features_partitioned ({", ".join(feature_columns)})
+            SELECT {feature_select}
+            FROM flight_features ff
+            JOIN flights f ON f.id = ff.flight_id
+            WHERE ff.flight_id > $1 AND ff.flight_id <= $2
+        """
+
+        max_id = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM flights")
+        copied_flights = await _copy_batches(conn, copy_flights, 0, max_id, batch_size, "flights")
+        copied_features = await _copy_batches(conn, copy_features, 0, max_id, batch_size, "flight_features")
+
+        # Финальный шаг под блокировкой записи: догоняем хвост, изменения фактов и меняем таблицы местами
+        async with conn.transaction():
+            await conn.execute("LOCK TABLE flights, flight_features IN EXCLUSIVE MODE")
+            tail = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM flights")
+            await conn.execute(copy_flights, copied_flights, tail)
+            await conn.execute(copy_features, copied_features, tail)
+            # Повторная загрузка меняет факты вместе с content_hash (app/idempotency.py)
+            synced = ["fact_departure", "fact_arrival"]
+            if "content_hash" in await _columns(conn, "flights"):
+                synced.append("content_hash")
+            changed = await conn.fetch(f"""
+                UPDATE flights_partitioned p
+                SET {", ".join(f"{column} = f.{column}" for column in synced)}
+                FROM flights f
+                WHERE p.id = f.id
+                AND p.id <= $1
+                AND ({", ".join(f"p.{column}" for column in synced)})
+                    IS DISTINCT FROM ({", ".join(f"f.{column}" for column in synced)})
+                RETURNING p.id
+            """, copied_flights)
+            await conn.execute("""
+                ALTER TABLE flights RENAME TO flights_legacy;
+                ALTER TABLE flights_partitioned RENAME TO flights;
+                ALTER TABLE flight_features RENAME TO flight_features_legacy;
+                ALTER TABLE flight_features_partitioned RENAME TO flight_features;
+            """)
+            sequence = await conn.fetchval("SELECT pg_get_serial_sequence('flights_legacy', 'id')")
+            if sequence:
+                await conn.execute(f"ALTER SEQUENCE {sequence} OWNED BY flights.id")
+
+            if changed:
+                await derive_flight_features(conn, [r["id"] for r in changed])
+
+        print("Готово: старые таблицы сохранены как flights_legacy и flight_features_legacy")
+    finally:
+        await conn.close()
+
+
+async def _feature_key(dsn: str, batch_size: int):
+    conn = await asyncpg.connect(dsn)
+    try:
+        await add_feature_key(conn, batch_size)
+    finally:
+        await conn.close()
+
+
+async def _ensure(dsn: str, months_ahead: int):
+    conn = await asyncpg.connect(dsn)
+    try:
+        created = await ensure_future_partitions(conn, months_ahead)
+        print(f"Секции: {', '.join(created) or 'нет'}")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Секционирование flights и flight_features")
+    parser.add_argument("--dsn", default=os.getenv('DB_DSN'))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="Перенести данные в секционированные таблицы")
+    migrate_parser.add_argument("--batch-size", type=int, default=50_000)
+    migrate_parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+
+    ensure_parser = commands.add_parser("ensure", help="Создать будущие секции")
+    ensure_parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+
+    feature_key_parser = commands.add_parser(
+        "feature-key", help="Добавить и заполнить flight_features.plan_departure без секционирования"
+    )
+    feature_key_parser.add_argument("--batch-size", type=int, default=50_000)
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        asyncio.run(migrate(args.dsn, args.batch_size, args.months_ahead))
+    elif args.command == "feature-key":
+        asyncio.run(_feature_key(args.dsn, args.batch_size))
+    else:
+        asyncio.run(_ensure(args.dsn, args.months_ahead))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import csv
+import io
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
+from DB.Database import db
+from app.rate_limit import Lease, admission
+from app.retention import EXPORT_COLUMNS, read_archive
+
+router = APIRouter()
+
+EXPORT_BATCH_SIZE = 10_000
+
+
+def _csv_chunk(rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in (row[name] for name in EXPORT_COLUMNS)
+        ])
+    return buffer.getvalue()
+
+
+async def _hot_rows(date_from, date_to, airline):
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM flights WHERE 1=1"
+    params = []
+    if airline:
+        params.append(airline)
+        query += f" AND iata_code = ${len(params)}"
+    if date_from:
+        params.append(date_from)
+        query += f" AND plan_departure >= ${len(params)}::date"
+    if date_to:
+        params.append(date_to)
+        query += f" AND plan_departure < ${len(params)}::date + 1"
+    query += " ORDER BY plan_departure"
+
+    async with db.connection() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(query, *params)
+            while True:
+                rows = await cursor.fetch(EXPORT_BATCH_SIZE)
+                if not rows:
+                    return
+                yield rows
+
+
+@router.get("/export/flights")
+async def export_flights(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    airline: Optional[str] = None,
+    include_archive: bool = True,
+    lease: Lease = Depends(admission("heavy"))
+):
+    """
+    CSV-выгрузка рейсов: архивные месяцы читаются из Parquet, остальное — из flights
+    """
+    # Зависимости с yield завершаются до отправки тела, поэтому место в лимите держит сам поток
+    async def generate():
+        try:
+            yield _csv_chunk([], header=True)
+            if include_archive:
+                async for rows in iterate_in_threadpool(read_archive(date_from, date_to, airline, EXPORT_BATCH_SIZE)):
+                    yield _csv_chunk(rows)
+            async for rows in _hot_rows(date_from, date_to, airline):
+                yield _csv_chunk(rows)
+        finally:
+            lease.release()
+
+    response = StreamingResponse(
+        generate(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=flights.csv"},
+        background=BackgroundTask(lease.release)
+    )
+    lease.detach()
+    return response
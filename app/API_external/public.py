@@ -2,6 +2,9 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 from datetime import datetime, date
 from typing import List, Optional
 from utils import get_db
+from app.airport_index import airport_index
+from app.serialization import records_response, fetch_json_array
+from app.rate_limit import admission
 
 router = APIRouter()
 
@@ -27,9 +30,9 @@ async def get_top_airlines(
         LIMIT $1
     """
     results = await conn.fetch(query, limit)
-    return [dict(row) for row in results]
+    return records_response(results)
 
-@router.get("/airports/{iata_code}/stats")
+@router.get("/airports/{iata_code}/stats", dependencies=[Depends(admission("heavy"))])
 async def airport_stats(
     iata_code: str,
     conn = Depends(get_db)
@@ -44,27 +47,35 @@ async def airport_stats(
     query = """
         SELECT 
             (SELECT COUNT(*) FROM flights 
-             WHERE departure_airport = $1) AS departures,
+             WHERE departure_airport = $1)
+            + (SELECT COALESCE(SUM(total_flights), 0) FROM flight_rollups
+               WHERE departure_airport = $1)::BIGINT AS departures,
             
             (SELECT COUNT(*) FROM flights 
-             WHERE arrival_airport = $1) AS arrivals,
+             WHERE arrival_airport = $1)
+            + (SELECT COALESCE(SUM(total_flights), 0) FROM flight_rollups
+               WHERE arrival_airport = $1)::BIGINT AS arrivals,
             
             (SELECT COUNT(*) FROM flights 
              WHERE departure_airport = $1 
-             AND fact_departure IS NULL) AS missing_departures,
+             AND fact_departure IS NULL)
+            + (SELECT COALESCE(SUM(cancellations), 0) FROM flight_rollups
+               WHERE departure_airport = $1)::BIGINT AS missing_departures,
             
             (SELECT COUNT(*) FROM flights 
              WHERE arrival_airport = $1 
-             AND fact_arrival IS NULL) AS missing_arrivals,
+             AND fact_arrival IS NULL)
+            + (SELECT COALESCE(SUM(missing_arrivals), 0) FROM flight_rollups
+               WHERE arrival_airport = $1)::BIGINT AS missing_arrivals,
             
             (SELECT COUNT(*) FROM flight_features 
              WHERE departure_airport = $1 
              OR arrival_airport = $1) AS features_recorded
     """
     stats = await conn.fetchrow(query, iata_code)
-    return dict(stats)
+    return records_response(stats)
 
-@router.get("/flights")
+@router.get("/flights", dependencies=[Depends(admission("heavy"))])
 async def search_flights(
     airline: Optional[str] = None,
     departure_airport: Optional[str] = None,
@@ -85,13 +96,17 @@ async def search_flights(
             ff.day_of_week, ff.time_of_day, 
             ff.season, ff.delay_category
         FROM flights f
-        LEFT JOIN flight_features ff ON f.id = ff.flight_id
+        LEFT JOIN flight_features ff
+            ON f.id = ff.flight_id
+            AND f.plan_departure = ff.plan_departure
+            {feature_conditions}
         WHERE 1=1
     """
     params = []
     count = 1
     
     conditions = []
+    feature_conditions = []
     
     if airline:
         conditions.append(f"f.iata_code = ${count}")
@@ -108,13 +123,16 @@ async def search_flights(
         params.append(arrival_airport)
         count += 1
         
+    # Сравнение с самим plan_departure (без DATE()) позволяет отсечь лишние секции
     if date_from:
-        conditions.append(f"DATE(f.plan_departure) >= ${count}")
+        conditions.append(f"f.plan_departure >= ${count}::date")
+        feature_conditions.append(f"ff.plan_departure >= ${count}::date")
         params.append(date_from)
         count += 1
         
     if date_to:
-        conditions.append(f"DATE(f.plan_departure) <= ${count}")
+        conditions.append(f"f.plan_departure < ${count}::date + 1")
+        feature_conditions.append(f"ff.plan_departure < ${count}::date + 1")
         params.append(date_to)
         count += 1
         
@@ -134,14 +152,16 @@ async def search_flights(
         params.append(max_delay)
         count += 2
     
+    base_query = base_query.format(
+        feature_conditions="".join(f" AND {c}" for c in feature_conditions)
+    )
     if conditions:
         base_query += " AND " + " AND ".join(conditions)
     
     base_query += f" ORDER BY f.plan_departure DESC LIMIT ${count}"
     params.append(limit)
     
-    results = await conn.fetch(base_query, *params)
-    return [dict(row) for row in results]
+    return await fetch_json_array(conn, base_query, *params)
 
 @router.get("/flights/{flight_id}")
 async def flight_details(
@@ -160,7 +180,9 @@ async def flight_details(
         FROM flights f
         JOIN airports dep ON f.departure_airport = dep.iata_code
         JOIN airports arr ON f.arrival_airport = arr.iata_code
-        LEFT JOIN flight_features ff ON f.id = ff.flight_id
+        LEFT JOIN flight_features ff
+            ON f.id = ff.flight_id
+            AND f.plan_departure = ff.plan_departure
         WHERE f.id = $1
     """
     result = await conn.fetchrow(query, flight_id)
@@ -168,7 +190,7 @@ async def flight_details(
     if not result:
         raise HTTPException(status_code=404, detail="Flight not found")
     
-    return dict(result)
+    return records_response(result)
 
 @router.get("/airlines/{iata_code}/delay-stats")
 async def airline_delay_stats(
@@ -188,19 +210,47 @@ async def airline_delay_stats(
             COUNT(*) AS count,
             ROUND(AVG(EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival)))) AS avg_delay_seconds
         FROM flights f
-        JOIN flight_features ff ON f.id = ff.flight_id
+        JOIN flight_features ff
+            ON f.id = ff.flight_id
+            AND f.plan_departure = ff.plan_departure
         WHERE f.iata_code = $1
         GROUP BY ff.delay_category
     """
     results = await conn.fetch(query, iata_code)
-    return [dict(row) for row in results]
+    return records_response(results)
+
+@router.get("/airports/nearest")
+async def nearest_airports(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(5, ge=1, le=100),
+    radius_km: Optional[float] = Query(None, gt=0, le=20_000)
+):
+    if not airport_index.loaded:
+        raise HTTPException(status_code=503, detail="Airport index not loaded")
+    return airport_index.nearest(lat, lon, limit, radius_km)
+
+@router.get("/airports/bbox")
+async def airports_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180)
+):
+    if not airport_index.loaded:
+        raise HTTPException(status_code=503, detail="Airport index not loaded")
+    return airport_index.bbox(min_lat, min_lon, max_lat, max_lon)
 
 @router.get("/airports")
 async def search_airports(
     city: Optional[str] = None,
     country: Optional[str] = None,
+    name: Optional[str] = None,
     conn = Depends(get_db)
 ):
+    if airport_index.loaded:
+        return airport_index.search(city=city, name=name, country=country)
+    
     base_query = """
         SELECT 
             iata_code, airport_name, city, timezone,
@@ -221,9 +271,14 @@ async def search_airports(
         conditions.append(f"LOWER(country) LIKE LOWER(${count})")
         params.append(f"%{country}%")
         count += 1
+        
+    if name:
+        conditions.append(f"LOWER(airport_name) LIKE LOWER(${count})")
+        params.append(f"%{name}%")
+        count += 1
     
     if conditions:
         base_query += " AND " + " AND ".join(conditions)
     
     results = await conn.fetch(base_query, *params)
-    return [dict(row) for row in results]
+    return records_response(results)
@@ -1,14 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Header
 from pydantic import BaseModel, Field, validator, constr, ConfigDict, field_validator
-from datetime import datetime
-from typing import List, Optional
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 import secrets
 import os
+import time
 from utils import get_db
+from DB.Database import db
+from app.features import derive_flight_features
+from app.broadcast import schedule_upload_deltas
+from app.rate_limit import admission, guarded_connection
+from app.idempotency import (
+    batch_hash, claim_batch, complete_batch, content_hash, fetch_existing, release_batch, row_key
+)
 
 router = APIRouter()
 
 ADMIN_SECRET = os.getenv("ADMIN_SECRET", "default-admin-secret")
+# Проверенные токены кэшируются, чтобы лимит /upload срабатывал без обращения к пулу.
+# Деактивация сбрасывает кэш своего воркера, остальные увидят её не позже чем через этот срок
+TOKEN_CACHE_SECONDS = int(os.getenv('TOKEN_CACHE_SECONDS', '30'))
+MAX_CACHED_TOKENS = 10_000
+
+# токен -> (код авиакомпании или None для неизвестного токена, время истечения)
+_token_cache: Dict[str, Tuple[Optional[str], float]] = {}
 
 class FlightData(BaseModel):
     model_config = ConfigDict(extra='forbid')
@@ -21,6 +36,16 @@ class FlightData(BaseModel):
     fact_departure: Optional[datetime] = Field(None, description="Фактическое время вылета (ISO 8601)")
     fact_arrival: Optional[datetime] = Field(None, description="Фактическое время прибытия (ISO 8601)")
 
+    @field_validator('plan_departure', 'plan_arrival', 'fact_departure', 'fact_arrival')
+    def to_utc(cls, v):
+        """
+        Время без зоны трактуется так же, как его записал бы asyncpg (локальное время хоста):
+        поиск, запись и хеш строки используют одно и то же значение
+        """
+        if v is None:
+            return v
+        return v.astimezone(timezone.utc)
+
     @field_validator('plan_arrival', 'fact_arrival')
     def check_arrival_after_departure(cls, v, info):
         """Проверяет, что время прибытия позже времени вылета"""
@@ -34,9 +59,29 @@ class FlightData(BaseModel):
             raise ValueError(f"{info.field_name} должно быть после {dep_field_name}")
         return v
 
+async def _lookup_token(token: str) -> Optional[str]:
+    now = time.monotonic()
+    cached = _token_cache.get(token)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    async with guarded_connection() as conn:
+        airline_code = await conn.fetchval(
+            "SELECT airline_iata_code FROM tokens WHERE token = $1 AND is_active",
+            token
+        )
+
+    if len(_token_cache) >= MAX_CACHED_TOKENS:
+        # Выдуманные токены не должны вытеснять настоящие: сначала истёкшие и неизвестные
+        for key in [key for key, (code, expires) in _token_cache.items() if expires <= now or code is None]:
+            del _token_cache[key]
+        while len(_token_cache) >= MAX_CACHED_TOKENS:
+            del _token_cache[next(iter(_token_cache))]
+    _token_cache[token] = (airline_code, now + TOKEN_CACHE_SECONDS)
+    return airline_code
+
 async def get_airline_from_token(
-    authorization: Optional[str] = Header(None),
-    conn = Depends(get_db)
+    authorization: Optional[str] = Header(None)
 ):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(
@@ -46,18 +91,15 @@ async def get_airline_from_token(
     
     token = authorization.split(" ")[1]
     
-    result = await conn.fetchrow(
-        "SELECT airline_iata_code FROM tokens WHERE token = $1 AND is_active",
-        token
-    )
+    airline_code = await _lookup_token(token)
     
-    if not result:
+    if not airline_code:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid or inactive token"
         )
     
-    return result["airline_iata_code"]
+    return airline_code
 
 async def verify_admin(
     x_admin_secret: str = Header(..., alias="X-Admin-Secret")
@@ -111,78 +153,139 @@ async def deactivate_token(
             detail="Token not found"
         )
     
+    _token_cache.pop(token, None)
+    
     return {"status": "deactivated"}
 
-@router.post("/upload")
+@router.post("/upload", dependencies=[Depends(admission("upload", get_airline_from_token))])
 async def upload_flights(
     flights_data: List[FlightData],
     airline_code: str = Depends(get_airline_from_token),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=200),
     conn = Depends(get_db)
 ):
+    rows = [flight.model_dump() for flight in flights_data]
+    hashes = [content_hash(row) for row in rows]
+
+    if idempotency_key:
+        previous = await claim_batch(conn, airline_code, idempotency_key, batch_hash(hashes))
+        if previous is not None:
+            if not previous["same_batch"]:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Idempotency-Key уже использован для другой пачки"
+                )
+            if previous["result"] is None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Пачка с этим Idempotency-Key ещё обрабатывается",
+                    headers={"Retry-After": "1"}
+                )
+            return previous["result"]
+
+    try:
+        result = await _ingest(conn, airline_code, rows, hashes)
+    except BaseException:
+        # В том числе отмена запроса; соединение запроса может быть уже непригодно, поэтому берём из пула.
+        # Если не выйдет и это, незавершённую заявку позже перехватит повтор (см. UPLOAD_CLAIM_LEASE_MINUTES)
+        if idempotency_key:
+            try:
+                await release_batch(db, airline_code, idempotency_key)
+            except Exception as e:
+                print(f"Error in release_batch: {e}")
+        raise
+
+    if idempotency_key:
+        await complete_batch(conn, airline_code, idempotency_key, result)
+    return result
+
+async def _ingest(conn, airline_code: str, rows: List[dict], hashes: List[bytes]) -> dict:
     processed = 0
+    unchanged = 0
     errors = []
-    
-    for flight in flights_data:
+    flight_ids = []
+    directions = set()
+
+    # Один запрос на всю пачку вместо поиска каждой строки; неизменные рейсы пропускаются
+    existing = await fetch_existing(
+        conn, airline_code,
+        list({row_key(row["flight"], row["plan_departure"]) for row in rows})
+    )
+
+    for flight, digest in zip(rows, hashes):
         try:
-            flight_dict = flight.model_dump()
-            
-            existing = await conn.fetchrow(
-                """
-                SELECT id FROM flights 
-                WHERE iata_code = $1 
-                AND flight = $2 
-                AND plan_departure = $3
-                """,
-                airline_code, 
-                flight.flight, 
-                flight.plan_departure
-            )
-            
-            if existing:
+            key = row_key(flight["flight"], flight["plan_departure"])
+            known = existing.get(key)
+
+            if known and known[1] is not None and bytes(known[1]) == digest:
+                unchanged += 1
+                processed += 1
+                continue
+
+            if known:
                 await conn.execute(
                     """
                     UPDATE flights 
                     SET fact_departure = $1,
-                        fact_arrival = $2
-                    WHERE id = $3
+                        fact_arrival = $2,
+                        content_hash = $3
+                    WHERE id = $4
                     """,
-                    flight.fact_departure,
-                    flight.fact_arrival,
-                    existing["id"]
+                    flight["fact_departure"],
+                    flight["fact_arrival"],
+                    digest,
+                    known[0]
                 )
+                flight_ids.append(known[0])
             else:
-                await conn.execute(
+                flight_id = await conn.fetchval(
                     """
                     INSERT INTO flights (
                         iata_code, flight, 
                         departure_airport, arrival_airport,
                         plan_departure, plan_arrival,
-                        fact_departure, fact_arrival
+                        fact_departure, fact_arrival,
+                        content_hash
                     ) VALUES (
-                        $1, $2, $3, $4, $5, $6, $7, $8
+                        $1, $2, $3, $4, $5, $6, $7, $8, $9
                     )
+                    RETURNING id
                     """,
                     airline_code,
-                    flight.flight,
-                    flight.departure_airport,
-                    flight.arrival_airport,
-                    flight.plan_departure,
-                    flight.plan_arrival,
-                    flight.fact_departure,
-                    flight.fact_arrival
+                    flight["flight"],
+                    flight["departure_airport"],
+                    flight["arrival_airport"],
+                    flight["plan_departure"],
+                    flight["plan_arrival"],
+                    flight["fact_departure"],
+                    flight["fact_arrival"],
+                    digest
                 )
+                flight_ids.append(flight_id)
+            # Повтор рейса внутри пачки должен обновить только что вставленную строку
+            existing[key] = (flight_ids[-1], digest)
             
+            directions.add((flight["departure_airport"], flight["arrival_airport"]))
             processed += 1
             
         except Exception as e:
             errors.append({
-                "flight": flight.flight,
+                "flight": flight["flight"],
                 "error": f"Ошибка: {str(e)}"
             })
     
+    if flight_ids:
+        try:
+            await derive_flight_features(conn, flight_ids)
+        except Exception as e:
+            print(f"Error in derive_flight_features: {e}")
+        
+        schedule_upload_deltas(airline_code, directions)
+    
     return {
         "status": "success" if not errors else "partial",
         "processed": processed,
+        "unchanged": unchanged,
         "errors": errors,
-        "message": f"Обработано рейсов: {processed}, ошибок: {len(errors)}"
+        "message": f"Обработано рейсов: {processed}, без изменений: {unchanged}, ошибок: {len(errors)}"
     }
@@ -1,18 +1,25 @@
-import json
+import csv
+import heapq
 import os
 import aiofiles
-import pandas as pd
-import numpy as np
-from fastapi import Depends, APIRouter, HTTPException, BackgroundTasks
-from utils import get_db, format_datetime, get_db_connection
-from mlxtend.frequent_patterns import apriori, association_rules
-from mlxtend.preprocessing import TransactionEncoder
-from scipy.sparse import csr_matrix
-import asyncio
+from fastapi import Depends, APIRouter, HTTPException, BackgroundTasks, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import List
+from utils import get_db
+from app.route_graph import route_graph, MAX_HOPS
+from app.serialization import records_response, raw_json_response, fetch_json_array
+from app.broadcast import punctuality_events
+from app.rate_limit import admission
+from app.airport_index import airport_index
+from app.delay_predictor import RULES_FILE, rule_matcher, flight_features
 from concurrent.futures import ThreadPoolExecutor
+import threading
 
 router = APIRouter()
-RULES_FILE = 'resources/flight_delay_rules.csv'
+PREDICT_BATCH_LIMIT = 10_000
+analysis_lock = threading.Lock()
 
 @router.get("/get_top3")
 async def get_top_three(conn = Depends(get_db)):
@@ -28,19 +35,13 @@ async def get_top_three(conn = Depends(get_db)):
             a.name AS airline_name,
             lr.rating_departure,
             lr.rating_arrival,
-            lr.created_at
+            to_char(lr.created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD') AS created_at
         FROM latest_ratings lr
         JOIN airlines a ON lr.airline_iata_code = a.iata_code
         ORDER BY lr.rating_departure DESC, lr.rating_arrival DESC, lr.created_at DESC
         LIMIT 3;
                             """)
-    return [
-        {
-            **dict(row),
-            "created_at": format_datetime(row["created_at"])
-        }
-        for row in results
-    ]
+    return records_response(results)
     
 @router.get("/get_all_direction")
 async def get_all_flight_direction():
@@ -48,10 +49,41 @@ async def get_all_flight_direction():
     if not os.path.exists(file_path):
         return {"error": "File not found"}
 
-    with open(file_path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
+    with open(file_path, 'rb') as file:
+        data = file.read()
     
-    return data
+    return raw_json_response(data)
+
+@router.get("/routes/best")
+async def get_best_connection(source: str, target: str, max_hops: int = Query(2, ge=1, le=MAX_HOPS)):
+    """
+    Самый пунктуальный маршрут между двумя аэропортами (не более max_hops перелётов)
+    """
+    result = route_graph.best_connection(source.upper(), target.upper(), max_hops)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Маршрут не найден")
+    return result
+
+@router.get("/routes/{iata_code}/neighbours")
+async def get_reliable_neighbours(iata_code: str, limit: int = Query(10, ge=1, le=500), min_flights: int = 0):
+    """
+    Самые пунктуальные прямые направления из аэропорта
+    """
+    index = route_graph.index.get(iata_code.upper())
+    if index is None:
+        raise HTTPException(status_code=404, detail="Аэропорт не найден")
+    neighbours = [
+        n for n in route_graph.neighbours[index]
+        if n["total_flights"] >= min_flights
+    ]
+    return neighbours[:limit]
+
+@router.get("/routes/hubs")
+async def get_hub_ranking(limit: int = Query(10, ge=1, le=500)):
+    """
+    Рейтинг аэропортов-хабов по центральности в графе направлений
+    """
+    return route_graph.hubs[:limit]
 
 @router.get("/get_airline_punctuality")
 async def get_airline_punctuality():
@@ -59,13 +91,24 @@ async def get_airline_punctuality():
     if not os.path.exists(file_path):
         return {"error": "File not found"}
 
-    async with aiofiles.open(file_path, 'r', encoding='utf-8') as file:
+    async with aiofiles.open(file_path, 'rb') as file:
         data = await file.read()
-        return json.loads(data)
+        return raw_json_response(data)
     
-@router.get("/get_airports")
+@router.get("/events/punctuality")
+async def stream_punctuality_events():
+    """
+    SSE-поток: после каждой загрузки приходят обновлённые агрегаты авиакомпании и направлений
+    """
+    return StreamingResponse(
+        punctuality_events.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/get_airports", dependencies=[Depends(admission("heavy"))])
 async def get_airports(conn = Depends(get_db)):
-    results = await conn.fetch("""
+    return await fetch_json_array(conn, """
         SELECT 
             a.iata_code AS "IATA код",
             a.airport_name AS "Название аэропорта",
@@ -76,66 +119,89 @@ async def get_airports(conn = Depends(get_db)):
         FROM airports a
         LEFT JOIN (
             SELECT 
-                departure_airport AS iata_code,
-                COUNT(*) AS departure_count
-            FROM flights
-            GROUP BY departure_airport
+                iata_code,
+                SUM(n)::BIGINT AS departure_count
+            FROM (
+                SELECT departure_airport AS iata_code, COUNT(*) AS n
+                FROM flights
+                GROUP BY departure_airport
+                UNION ALL
+                SELECT departure_airport, SUM(total_flights)
+                FROM flight_rollups
+                GROUP BY departure_airport
+            ) d
+            GROUP BY iata_code
         ) dep ON a.iata_code = dep.iata_code
         LEFT JOIN (
             SELECT 
-                arrival_airport AS iata_code,
-                COUNT(*) AS arrival_count
-            FROM flights
-            GROUP BY arrival_airport
-        ) arr ON a.iata_code = arr.iata_code;
+                iata_code,
+                SUM(n)::BIGINT AS arrival_count
+            FROM (
+                SELECT arrival_airport AS iata_code, COUNT(*) AS n
+                FROM flights
+                GROUP BY arrival_airport
+                UNION ALL
+                SELECT arrival_airport, SUM(total_flights)
+                FROM flight_rollups
+                GROUP BY arrival_airport
+            ) r
+            GROUP BY iata_code
+        ) arr ON a.iata_code = arr.iata_code
                                """)
     
-    return [
-        {
-            **dict(row)
-        }
-        for row in results
-    ]
-    
     
-@router.get("/delay_histogram")
+@router.get("/delay_histogram", dependencies=[Depends(admission("heavy"))])
 async def delay_histogram(conn = Depends(get_db)):
     results = await conn.fetch("""
         SELECT
-            COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) <= 600) AS "0-10 минут",
-            COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 600 AND EXTRACT(EPOCH FROM ((fact_departure - plan_departure))) <= 1200) AS "11-20 минут",
-            COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 1200 AND EXTRACT(EPOCH FROM (fact_departure - plan_departure)) <= 1800) AS "21-30 минут",
-            COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 1800 AND EXTRACT(EPOCH FROM (fact_departure - plan_departure)) <= 7200) AS "31-120 минут",
-            COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 7200) AS ">120 минут"
-        FROM flights;
+            SUM(b0)::BIGINT AS "0-10 минут",
+            SUM(b1)::BIGINT AS "11-20 минут",
+            SUM(b2)::BIGINT AS "21-30 минут",
+            SUM(b3)::BIGINT AS "31-120 минут",
+            SUM(b4)::BIGINT AS ">120 минут"
+        FROM (
+            SELECT
+                COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) <= 600) AS b0,
+                COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 600 AND EXTRACT(EPOCH FROM ((fact_departure - plan_departure))) <= 1200) AS b1,
+                COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 1200 AND EXTRACT(EPOCH FROM (fact_departure - plan_departure)) <= 1800) AS b2,
+                COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 1800 AND EXTRACT(EPOCH FROM (fact_departure - plan_departure)) <= 7200) AS b3,
+                COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (fact_departure - plan_departure)) > 7200) AS b4
+            FROM flights
+            UNION ALL
+            SELECT
+                SUM(departure_delay_0_10),
+                SUM(departure_delay_11_20),
+                SUM(departure_delay_21_30),
+                SUM(departure_delay_31_120),
+                SUM(departure_delay_over_120)
+            FROM flight_rollups
+        ) s;
                         """)
     
-    return [
-        {
-            **dict(row)
-        }
-        for row in results
-    ]
+    return records_response(results)
     
     
-@router.get("/cancellations_distribution")
+@router.get("/cancellations_distribution", dependencies=[Depends(admission("heavy"))])
 async def get_cancellations_distribution(conn = Depends(get_db)):
     results = await conn.fetch("""
         SELECT 
             a.name AS airlines,
-            COUNT(*) FILTER (WHERE f.fact_departure IS NULL) AS cancellations
-        FROM flights f
-        JOIN airlines a ON f.iata_code = a.iata_code
+            SUM(s.cancellations)::BIGINT AS cancellations
+        FROM (
+            SELECT iata_code, COUNT(*) FILTER (WHERE fact_departure IS NULL) AS cancellations
+            FROM flights
+            GROUP BY iata_code
+            UNION ALL
+            SELECT iata_code, SUM(cancellations)
+            FROM flight_rollups
+            GROUP BY iata_code
+        ) s
+        JOIN airlines a ON s.iata_code = a.iata_code
         GROUP BY a.name
         ORDER BY cancellations DESC;
                                """)
     
-    return [
-        {
-            **dict(row)
-        }
-        for row in results
-    ]
+    return records_response(results)
 
 @router.get("/delay-rules/top")
 async def get_top_delay_rules(top_n: int = 5):
@@ -149,17 +215,16 @@ async def get_top_delay_rules(top_n: int = 5):
         )
     
     try:
-        rules_df = pd.read_csv(RULES_FILE)
+        with open(RULES_FILE, 'r', encoding='utf-8', newline='') as file:
+            rows = list(csv.DictReader(file))
         
-        sorted_rules = rules_df.sort_values(
-            by=['lift', 'confidence'], 
-            ascending=False
+        top_rules = heapq.nlargest(
+            top_n, rows,
+            key=lambda row: (float(row['lift']), float(row['confidence']))
         )
         
-        top_rules = sorted_rules.head(top_n)
-        
         results = []
-        for _, row in top_rules.iterrows():
+        for row in top_rules:
             results.append({
                 "rule": row['formatted_rule'],
                 "support": float(row['support']),
@@ -175,159 +240,82 @@ async def get_top_delay_rules(top_n: int = 5):
             detail=f"Ошибка при обработке файла правил: {str(e)}"
         )
 
-@router.post("/delay-rules/refresh")
+@router.post("/delay-rules/refresh", dependencies=[Depends(admission("refresh"))])
 async def refresh_delay_rules(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_analysis_task)
+    # Анализ выполняется дольше запроса, поэтому одновременный запуск ограничивается отдельно.
+    # Блокировку берёт сама фоновая задача: если она не запустится, блокировка не повиснет.
+    if analysis_lock.locked():
+        raise HTTPException(
+            status_code=429,
+            detail="Анализ уже выполняется",
+            headers={"Retry-After": "60"}
+        )
+    background_tasks.add_task(_run_analysis)
     return {"status": "started", "message": "Анализ запущен в фоновом режиме"}
 
-async def async_load_data_from_db():
-    """Асинхронная загрузка данных из БД"""
-    async with get_db_connection() as conn:
-        rows = await conn.fetch("SELECT * FROM flight_features")
-        return pd.DataFrame([dict(r) for r in rows])
-
-def prepare_transactions(df):
-    transactions = []
-    for _, row in df.iterrows():
-        transaction = []
-        for col in df.columns:
-            transaction.append(f"{col}={row[col]}")
-        transactions.append(transaction)
-    return transactions
-
-def format_rule(antecedents, consequents):
-    condition_map = {
-        'day_of_week': {
-            'Понедельник': 'понедельник',
-            'Вторник': 'вторник',
-            'Среда': 'среда',
-            'Четверг': 'четверг',
-            'Пятница': 'пятница',
-            'Суббота': 'суббота',
-            'Воскресенье': 'воскресенье'
-        },
-        'time_of_day': {
-            'Утро': 'утро',
-            'День': 'день',
-            'Вечер': 'вечер',
-            'Ночь': 'ночь'
-        },
-        'season': {
-            'Зима': 'зима',
-            'Весна': 'весна',
-            'Лето': 'лето',
-            'Осень': 'осень'
-        }
-    }
-
-    conditions = []
-    delay = None
-
-    for item in antecedents:
-        col, val = item.split('=')
-        if col in condition_map:
-            conditions.append(condition_map[col].get(val, val))
-        elif col == 'departure_airport':
-            conditions.append(f'аэропорт вылета {val}')
-        elif col == 'arrival_airport':
-            conditions.append(f'аэропорт прилета {val}')
-        elif col == 'airline_iata_code':
-            conditions.append(f'авиакомпания {val}')
-
-    for item in consequents:
-        col, val = item.split('=')
-        if col == 'delay_category':
-            if val == 'Нет_задержки':
-                delay = 'нет задержки'
-            elif val == 'Короткая':
-                delay = 'короткая задержка'
-            elif val == 'Средняя':
-                delay = 'средняя задержка'
-            elif val == 'Длинная':
-                delay = 'длинная задержка'
-            elif val == 'Очень_длинная':
-                delay = 'очень длинная задержка'
-
-    return f"если {', '.join(conditions)}, то {delay}"
-
-def find_delay_rules(transactions, min_support=0.05):
-    te = TransactionEncoder()
-    
-    te_ary = te.fit(transactions).transform(transactions, sparse=True)
-    
-    sparse_matrix = csr_matrix(te_ary, dtype=bool)
-    
-    item_support = np.array(sparse_matrix.mean(axis=0)).flatten()
-    
-    mask = item_support >= min_support
-    selected_columns = [te.columns_[i] for i in np.where(mask)[0]]
-    
-    filtered_matrix = sparse_matrix[:, mask]
-    df_encoded = pd.DataFrame.sparse.from_spmatrix(
-        filtered_matrix,
-        columns=selected_columns
-    )
-
-    delay_columns = [col for col in df_encoded.columns if 'delay_category=' in col]
-    other_columns = [col for col in df_encoded.columns if 'delay_category=' not in col]
-    
-    if len(other_columns) > 1000:
-        other_columns = other_columns[:1000]
-    
-    df_encoded = df_encoded[delay_columns + other_columns]
+def _run_analysis():
+    if not analysis_lock.acquire(blocking=False):
+        print("Анализ уже выполняется, повторный запуск пропущен")
+        return
+    try:
+        # pandas/mlxtend/scipy загружаются только здесь, а не при старте API
+        from app.analytics import run_analysis_task
+        run_analysis_task()
+    finally:
+        analysis_lock.release()
 
-    print(f"Используется {len(df_encoded.columns)} колонок после фильтрации")
+class PlannedFlight(BaseModel):
+    airline: str = Field(..., min_length=2, max_length=3, description="Код авиакомпании")
+    departure_airport: str = Field(..., min_length=3, max_length=3, description="Код аэропорта вылета")
+    arrival_airport: str = Field(..., min_length=3, max_length=3, description="Код аэропорта прибытия")
+    plan_departure: datetime = Field(..., description="Плановое время вылета (ISO 8601, без зоны — локальное время сервера, как в /upload)")
 
-    frequent_itemsets = apriori(
-        df_encoded,
-        min_support=min_support,
-        use_colnames=True,
-        low_memory=True,
-        max_len=4
-    )
+class PlannedSchedule(BaseModel):
+    flights: List[PlannedFlight] = Field(..., min_length=1, max_length=PREDICT_BATCH_LIMIT)
 
-    if not frequent_itemsets.empty:
-        rules = association_rules(
-            frequent_itemsets,
-            metric="lift",
-            min_threshold=1.5,
-            support_only=False
+def _rules_matcher():
+    rule_matcher.refresh_if_stale()
+    if not rule_matcher.loaded:
+        raise HTTPException(
+            status_code=404,
+            detail="Файл с правилами не найден. Запустите анализ сначала."
         )
+    return rule_matcher
 
-        delay_rules = rules[
-            rules['consequents'].apply(
-                lambda x: any('delay_category=' in item for item in x) and 
-                not any('delay_category=Нет_задержки' in item for item in x)
-            )
-        ]
-
-        delay_rules['formatted_rule'] = delay_rules.apply(
-            lambda x: format_rule(x['antecedents'], x['consequents']),
-            axis=1
-        )
+def _planned_features(flight: PlannedFlight) -> dict:
+    airport = airport_index.get(flight.departure_airport)
+    return flight_features(
+        flight.airline, flight.departure_airport, flight.arrival_airport,
+        flight.plan_departure, airport["timezone"] if airport else None
+    )
 
-        return delay_rules.sort_values(by=['lift', 'confidence'], ascending=False)
-    
-    print("Не найдено частых наборов с заданным min_support.")
-    return pd.DataFrame()
+@router.post("/predict-delay")
+async def predict_delay(flight: PlannedFlight):
+    """
+    Оценивает вероятности категорий задержки рейса по правилам из flight_delay_rules.csv
+    """
+    matcher = _rules_matcher()
+    features = _planned_features(flight)
+    scored = matcher.score(matcher.mask(features))
+    return {
+        "features": features,
+        "probabilities": scored["probabilities"],
+        "category": scored["category"],
+        "rules": matcher.explain(scored["matched"])
+    }
 
-def run_analysis_task():
-    """Синхронная обертка для асинхронной загрузки"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        df = loop.run_until_complete(async_load_data_from_db())
-        print(f"Загружено {len(df)} строк")
-        
-        transactions = prepare_transactions(df)
-        rules = find_delay_rules(transactions, min_support=0.001)
-        
-        if not rules.empty:
-            rules.to_csv(RULES_FILE, index=False)
-            print("Результаты сохранены в flight_delay_rules.csv")
-        else:
-            print("Не удалось найти правила")
-    except Exception as e:
-        print(f"Ошибка при выполнении анализа: {str(e)}")
-    finally:
-        loop.close()
+@router.post("/predict-delay/batch")
+async def predict_delay_batch(schedule: PlannedSchedule):
+    """
+    Пакетная оценка расписания; рейсы с одинаковыми признаками оцениваются один раз
+    """
+    matcher = _rules_matcher()
+    cache = {}
+    results = []
+    for flight in schedule.flights:
+        mask = matcher.mask(_planned_features(flight))
+        if mask not in cache:
+            scored = matcher.score(mask)
+            cache[mask] = {"probabilities": scored["probabilities"], "category": scored["category"]}
+        results.append(cache[mask])
+    return results
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import math
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+EARTH_RADIUS_KM = 6371.0
+GRID_STEP = 1.0
+
+AIRPORTS_QUERY = """
+    SELECT
+        iata_code, airport_name, city, country, timezone,
+        longitude, latitude
+    FROM airports
+    ORDER BY iata_code
+"""
+
+FINGERPRINT_QUERY = """
+    SELECT md5(COALESCE(string_agg(
+        concat_ws('|', iata_code, airport_name, city, country, timezone, longitude, latitude),
+        ',' ORDER BY iata_code
+    ), ''))
+    FROM airports
+"""
+
+PUBLIC_FIELDS = ("iata_code", "airport_name", "city", "timezone", "longitude", "latitude")
+
+
+def _unit_vector(lat: float, lon: float) -> tuple:
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TextIndex:
+    """Триграммный индекс для поиска подстроки (как ILIKE '%q%')"""
+
+    def __init__(self, values: List[Optional[str]]):
+        self.values = [(v or "").lower() for v in values]
+        self.grams: Dict[str, set] = defaultdict(set)
+        for i, value in enumerate(self.values):
+            for gram in _trigrams(value):
+                self.grams[gram].add(i)
+
+    def search(self, query: str) -> set:
+        query = query.lower()
+        if len(query) < 3:
+            # Для запросов короче триграммы — линейный поиск подстроки, аэропортов немного
+            return {i for i, value in enumerate(self.values) if query in value}
+
+        candidates = None
+        for gram in _trigrams(query):
+            ids = self.grams.get(gram, set())
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return set()
+        return {i for i in candidates if query in self.values[i]}
+
+
+class AirportIndex:
+    """In-memory индекс аэропортов: k-d дерево для ближайших, сетка для прямоугольника, текстовые индексы"""
+
+    def __init__(self):
+        self.airports: List[dict] = []
+        self._by_iata: Dict[str, int] = {}
+        self.fingerprint: Optional[str] = None
+        self.loaded = False
+        self._tree: List[tuple] = []
+        self._grid: Dict[tuple, List[int]] = {}
+        self._city = TextIndex([])
+        self._name = TextIndex([])
+        self._country = TextIndex([])
+
+    async def load(self, conn):
+        rows = await conn.fetch(AIRPORTS_QUERY)
+        self.build([dict(row) for row in rows])
+        self.fingerprint = await conn.fetchval(FINGERPRINT_QUERY)
+
+    async def refresh_if_changed(self, conn) -> bool:
+        fingerprint = await conn.fetchval(FINGERPRINT_QUERY)
+        if fingerprint == self.fingerprint:
+            return False
+        await self.load(conn)
+        return True
+
+    def build(self, airports: List[dict]):
+        self.airports = airports
+        self._by_iata = {a["iata_code"]: i for i, a in enumerate(airports)}
+
+        located = [
+            i for i, a in enumerate(airports)
+            if a["latitude"] is not None and a["longitude"] is not None
+        ]
+        points = {
+            i: _unit_vector(float(airports[i]["latitude"]), float(airports[i]["longitude"]))
+            for i in located
+        }
+        tree = []
+        self._build_tree(tree, [(points[i], i) for i in located], 0)
+        self._tree = tree
+
+        grid = defaultdict(list)
+        for i in located:
+            grid[self._cell(float(airports[i]["latitude"]), float(airports[i]["longitude"]))].append(i)
+        self._grid = dict(grid)
+
+        self._city = TextIndex([a["city"] for a in airports])
+        self._name = TextIndex([a["airport_name"] for a in airports])
+        self._country = TextIndex([a.get("country") for a in airports])
+        self.loaded = True
+
+    def _build_tree(self, tree: List[tuple], items: List[tuple], depth: int) -> int:
+        """Узел: (точка, индекс аэропорта, ось, левый, правый); возвращает позицию узла или -1"""
+        if not items:
+            return -1
+        axis = depth % 3
+        items.sort(key=lambda item: item[0][axis])
+        middle = len(items) // 2
+        position = len(tree)
+        tree.append(None)
+        left = self._build_tree(tree, items[:middle], depth + 1)
+        right = self._build_tree(tree, items[middle + 1:], depth + 1)
+        point, index = items[middle]
+        tree[position] = (point, index, axis, left, right)
+        return position
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> tuple:
+        return (math.floor(lat / GRID_STEP), math.floor(lon / GRID_STEP))
+
+    def _public(self, index: int, **extra) -> dict:
+        airport = self.airports[index]
+        return {**{field: airport[field] for field in PUBLIC_FIELDS}, **extra}
+
+    def nearest(self, lat: float, lon: float, limit: int = 5, radius_km: Optional[float] = None) -> List[dict]:
+        if not self._tree or limit <= 0:
+            return []
+        target = _unit_vector(lat, lon)
+        max_chord = 2 * math.sin(radius_km / (2 * EARTH_RADIUS_KM)) if radius_km is not None else math.inf
+        best = []  # max-куча по (-квадрат хорды)
+
+        def visit(position: int):
+            if position == -1:
+                return
+            point, index, axis, left, right = self._tree[position]
+            distance = sum((p - t) ** 2 for p, t in zip(point, target))
+            if distance <= max_chord ** 2:
+                if len(best) < limit:
+                    heapq.heappush(best, (-distance, index))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, index))
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            bound = -best[0][0] if len(best) == limit else max_chord ** 2
+            if diff * diff <= bound:
+                visit(far)
+
+        visit(0)
+        return [
+            self._public(index, distance_km=round(_chord_to_km(math.sqrt(-d)), 1))
+            for d, index in sorted(best, reverse=True)
+        ]
+
+    def bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[dict]:
+        if min_lon > max_lon:
+            # Прямоугольник пересекает 180-й меридиан
+            return self.bbox(min_lat, min_lon, max_lat, 180.0) + self.bbox(min_lat, -180.0, max_lat, max_lon)
+        lat_lo, lon_lo = self._cell(min_lat, min_lon)
+        lat_hi, lon_hi = self._cell(max_lat, max_lon)
+        result = []
+        for cell_lat in range(lat_lo, lat_hi + 1):
+            for cell_lon in range(lon_lo, lon_hi + 1):
+                for index in self._grid.get((cell_lat, cell_lon), ()):
+                    airport = self.airports[index]
+                    if (min_lat <= float(airport["latitude"]) <= max_lat
+                            and min_lon <= float(airport["longitude"]) <= max_lon):
+                        result.append(index)
+        return [self._public(index) for index in sorted(result)]
+
+    def get(self, iata_code: str) -> Optional[dict]:
+        index = self._by_iata.get(iata_code)
+        return None if index is None else self.airports[index]
+
+    def search(self, city: Optional[str] = None, name: Optional[str] = None, country: Optional[str] = None) -> List[dict]:
+        ids = None
+        for text_index, query in ((self._city, city), (self._name, name), (self._country, country)):
+            if not query:
+                continue
+            found = text_index.search(query)
+            ids = found if ids is None else ids & found
+        if ids is None:
+            ids = range(len(self.airports))
+        return [self._public(index) for index in sorted(ids)]
+
+
+airport_index = AirportIndex()
+
+
+async def refresh_periodically(pool, interval: float = None):
+    """Фоновая задача: перестраивает индекс, если таблица airports изменилась"""
+    interval = interval or float(os.getenv('AIRPORTS_REFRESH_SECONDS', '300'))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with pool.acquire() as conn:
+                await airport_index.refresh_if_changed(conn)
+        except Exception as e:
+            print(f"Error in airport_index refresh: {e}")
@@ -0,0 +1,223 @@
+"""
+Пакетные задачи вне веб-процесса: пересчёт снимков агрегатов и поиск правил о задержках.
+
+    python -m app.batch aggregates --workers 4 --notify
+    python -m app.batch rules --date-from 2024-01-01 --date-to 2024-12-31 --output-dir out/
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+from datetime import date, datetime
+from typing import List, Optional
+import asyncpg
+from dotenv import load_dotenv
+from app.cluster import SNAPSHOTS_CHANNEL, NODE_ID
+from app.delay_predictor import RULES_FILE
+from app.features import split_range
+from app.serialization import dumps
+from utils import (
+    DIRECTION_STATS_QUERY, AIRLINE_PUNCTUALITY_QUERY, DIRECTIONS_SNAPSHOT, AIRLINES_SNAPSHOT,
+    format_airline_punctuality, write_snapshot
+)
+
+load_dotenv()
+
+
+class Filters:
+    """Общие условия для flights и flight_rollups (в обоих шаблонах псевдоним f)"""
+
+    def __init__(self, date_from: Optional[date], date_to: Optional[date], airlines: Optional[List[str]]):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.airlines = airlines
+        self.args = []
+        self.conditions = []
+        self.rollup_conditions = []
+        if date_from:
+            self.args.append(date_from)
+            self.conditions.append(f"f.plan_departure >= ${len(self.args)}::date")
+            # Свёртки помесячные: месяц, попавший в диапазон частично, учитывается целиком
+            self.rollup_conditions.append(f"f.month >= date_trunc('month', ${len(self.args)}::date)::date")
+        if date_to:
+            self.args.append(date_to)
+            self.conditions.append(f"f.plan_departure < ${len(self.args)}::date + 1")
+            self.rollup_conditions.append(f"f.month <= ${len(self.args)}::date")
+        if airlines:
+            self.args.append(airlines)
+            self.conditions.append(f"f.iata_code = ANY(${len(self.args)}::text[])")
+            self.rollup_conditions.append(f"f.iata_code = ANY(${len(self.args)}::text[])")
+
+    def render(self, extra: Optional[str] = None) -> dict:
+        def where(conditions):
+            conditions = conditions + ([extra] if extra else [])
+            return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return {"where": where(self.conditions), "rollup_where": where(self.rollup_conditions)}
+
+
+def _bucket(expr: str, chunks: int, chunk: int) -> Optional[str]:
+    if chunks <= 1:
+        return None
+    return f"(hashtext({expr}) & 2147483647) % {chunks} = {chunk}"
+
+
+def resource_usage(started: float) -> dict:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "wall_seconds": round(time.perf_counter() - started, 2),
+        "cpu_user_seconds": round(usage.ru_utime, 2),
+        "cpu_system_seconds": round(usage.ru_stime, 2),
+        "max_rss_kb": usage.ru_maxrss,
+    }
+
+
+async def _fetch_chunks(pool, query: str, filters: Filters, key_expr: str, workers: int) -> list:
+    """
+    Группы агрегатов делятся по хешу ключа, поэтому результаты частей просто объединяются.
+    Параллельные последовательные сканы одной таблицы Postgres синхронизирует (synchronize_seqscans).
+    """
+    async def run_chunk(chunk: int):
+        async with pool.acquire() as conn:
+            return await conn.fetch(
+                query.format(**filters.render(_bucket(key_expr, workers, chunk))),
+                *filters.args
+            )
+
+    parts = await asyncio.gather(*(run_chunk(chunk) for chunk in range(workers)))
+    return [row for part in parts for row in part]
+
+
+async def recompute_aggregates(pool, filters: Filters, workers: int, output_dir: Optional[str]) -> dict:
+    started = time.perf_counter()
+    directions_path = os.path.join(output_dir, os.path.basename(DIRECTIONS_SNAPSHOT)) if output_dir else DIRECTIONS_SNAPSHOT
+    airlines_path = os.path.join(output_dir, os.path.basename(AIRLINES_SNAPSHOT)) if output_dir else AIRLINES_SNAPSHOT
+
+    directions = await _fetch_chunks(
+        pool, DIRECTION_STATS_QUERY, filters, "LEAST(f.departure_airport, f.arrival_airport)", workers
+    )
+    directions.sort(key=lambda row: (row["airport1"], row["airport2"]))
+
+    airlines = await _fetch_chunks(pool, AIRLINE_PUNCTUALITY_QUERY, filters, "f.iata_code", workers)
+    # Как ORDER BY ... DESC в шаблоне: NULL первыми; при равенстве сохраняется порядок из БД
+    airlines.sort(key=lambda row: tuple(
+        -(row[column] if row[column] is not None else float("inf"))
+        for column in ("departure_percentage", "arrival_percentage")
+    ))
+
+    # Оба снимка пишутся через временный файл и os.replace
+    await write_snapshot(directions_path, dumps(directions, indent=True))
+    await write_snapshot(airlines_path, dumps(format_airline_punctuality(airlines), indent=True))
+    return {
+        "directions": len(directions),
+        "airlines": len(airlines),
+        "outputs": [directions_path, airlines_path],
+        **resource_usage(started),
+    }
+
+
+async def _features_bounds(conn, filters: Filters):
+    bounds = await conn.fetchrow("SELECT MIN(plan_departure) AS lo, MAX(plan_departure) AS hi FROM flight_features")
+    if bounds["lo"] is None:
+        return None
+    return filters.date_from or bounds["lo"].date(), filters.date_to or bounds["hi"].date()
+
+
+async def mine_rules(pool, filters: Filters, workers: int, chunk_days: int,
+                     min_support: float, output_dir: Optional[str]) -> dict:
+    # Стек анализа нужен только этой задаче
+    import pandas as pd
+    from app.analytics import fetch_features, prepare_transactions, find_delay_rules, save_rules
+
+    started = time.perf_counter()
+    path = os.path.join(output_dir, os.path.basename(RULES_FILE)) if output_dir else RULES_FILE
+
+    async with pool.acquire() as conn:
+        bounds = await _features_bounds(conn, filters)
+    if bounds is None:
+        return {"rows": 0, "rules": 0, **resource_usage(started)}
+
+    semaphore = asyncio.Semaphore(workers)
+
+    async def load_chunk(start: datetime, end: datetime):
+        where = "WHERE plan_departure >= $1 AND plan_departure < $2"
+        args = [start, end]
+        if filters.airlines:
+            where += " AND airline_iata_code = ANY($3::text[])"
+            args.append(filters.airlines)
+        async with semaphore, pool.acquire() as conn:
+            return await fetch_features(conn, where, *args)
+
+    parts = await asyncio.gather(*(
+        load_chunk(start, end) for start, end in split_range(bounds[0], bounds[1], chunk_days)
+    ))
+    df = pd.DataFrame([row for part in parts for row in part])
+    loaded = time.perf_counter()
+    print(f"Загружено {len(df)} строк за {loaded - started:.1f} с")
+    if df.empty:
+        return {"rows": 0, "rules": 0, **resource_usage(started)}
+
+    rules = find_delay_rules(prepare_transactions(df), min_support=min_support)
+    if not rules.empty:
+        save_rules(rules, path)
+    return {
+        "rows": len(df),
+        "rules": len(rules),
+        "load_seconds": round(loaded - started, 2),
+        "outputs": [path] if not rules.empty else [],
+        **resource_usage(started),
+    }
+
+
+async def _run(args) -> dict:
+    filters = Filters(args.date_from, args.date_to, args.airlines)
+    pool = await asyncpg.create_pool(args.dsn, min_size=1, max_size=args.workers)
+    try:
+        if args.command == "aggregates":
+            report = await recompute_aggregates(pool, filters, args.workers, args.output_dir)
+            if args.notify and not args.output_dir:
+                # Рабочие воркеры перечитают снимки, как после пересчёта лидером
+                await pool.execute("SELECT pg_notify($1, $2)", SNAPSHOTS_CHANNEL, f"batch:{NODE_ID}")
+        else:
+            report = await mine_rules(
+                pool, filters, args.workers, args.chunk_days, args.min_support, args.output_dir
+            )
+    finally:
+        await pool.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный пересчёт агрегатов и правил о задержках")
+    parser.add_argument("--dsn", default=os.getenv('DB_DSN'))
+    commands = parser.add_subparsers(dest="command", required=True)
+    aggregates_parser = commands.add_parser("aggregates", help="Пересчитать снимки направлений и авиакомпаний")
+    aggregates_parser.add_argument("--notify", action="store_true", help="Оповестить работающие воркеры")
+    rules_parser = commands.add_parser("rules", help="Найти ассоциативные правила о задержках")
+    rules_parser.add_argument("--chunk-days", type=int, default=30)
+    rules_parser.add_argument("--min-support", type=float, default=0.001)
+    for command_parser in (aggregates_parser, rules_parser):
+        command_parser.add_argument("--date-from", type=date.fromisoformat)
+        command_parser.add_argument("--date-to", type=date.fromisoformat)
+        command_parser.add_argument("--airlines", type=lambda value: [code.strip().upper() for code in value.split(",")],
+                                    help="Коды авиакомпаний через запятую")
+        command_parser.add_argument("--workers", type=int, default=4)
+        command_parser.add_argument("--output-dir", help="Каталог для результатов вместо рабочих путей")
+        command_parser.add_argument("--report", help="Путь к JSON-отчёту о ресурсах")
+    args = parser.parse_args()
+
+    if (args.date_from or args.date_to or args.airlines) and not args.output_dir:
+        parser.error("Частичный пересчёт нельзя публиковать вместо рабочих файлов: укажите --output-dir")
+
+    report = asyncio.run(_run(args))
+    report["command"] = args.command
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+import os
+from typing import AsyncIterator, Optional, Set
+from DB.Database import db
+from app import cluster
+from app.serialization import dumps
+from utils import fetch_upload_deltas
+
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', '16'))
+HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+_CLOSED = object()
+
+
+class Subscriber:
+    __slots__ = ("queue", "dropped")
+
+    def __init__(self, size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.dropped = False
+
+
+class Broadcaster:
+    """In-process рассылка событий: медленный подписчик с переполненной очередью отключается"""
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscriber] = set()
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: str, data) -> int:
+        """Сериализует событие один раз и раздаёт готовые байты всем подписчикам"""
+        if not self.subscribers:
+            return 0
+        self.sequence += 1
+        message = (
+            f"id: {self.sequence}\nevent: {event}\n".encode('utf-8')
+            + b"data: " + dumps(data) + b"\n\n"
+        )
+        delivered = 0
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+                delivered += 1
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+        return delivered
+
+    def _drop(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        subscriber.dropped = True
+        # Освобождаем место под маркер закрытия, чтобы разбудить генератор
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(_CLOSED)
+
+    async def stream(self, heartbeat: Optional[float] = HEARTBEAT_SECONDS) -> AsyncIterator[bytes]:
+        subscriber = self.subscribe()
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if message is _CLOSED:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+
+punctuality_events = Broadcaster()
+_pending: Set[asyncio.Task] = set()
+
+
+# Пар направлений в одном NOTIFY: ["SVO","LED"] занимает ~14 байт, лимит полезной нагрузки 8000
+ANNOUNCE_BATCH = 400
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def publish_upload_deltas(airline_code: str, directions):
+    try:
+        async with db.connection() as conn:
+            deltas = await fetch_upload_deltas(conn, airline_code, directions)
+        punctuality_events.publish("upload", {"airline_code": airline_code, **deltas})
+    except Exception as e:
+        print(f"Error in publish_upload_deltas: {e}")
+
+
+async def _announce_upload(airline_code: str, directions):
+    """Сообщает другим воркерам только ключи изменений — дельты считают те, у кого есть подписчики"""
+    pairs = sorted({tuple(sorted(pair)) for pair in directions})
+    try:
+        for start in range(0, len(pairs), ANNOUNCE_BATCH):
+            await cluster.coordinator.publish_event(
+                "upload", {"airline_code": airline_code, "directions": pairs[start:start + ANNOUNCE_BATCH]}
+            )
+    except Exception as e:
+        print(f"Error in announce_upload: {e}")
+
+
+def _publish_if_subscribed(airline_code: str, directions):
+    if directions and punctuality_events.subscribers:
+        _spawn(publish_upload_deltas(airline_code, directions))
+
+
+def schedule_upload_deltas(airline_code: str, directions):
+    """Дельты считаются в фоне и только в воркерах, где есть подписчики"""
+    if not directions:
+        return
+    if cluster.coordinator is not None and cluster.MULTI_WORKER:
+        _spawn(_announce_upload(airline_code, directions))
+    _publish_if_subscribed(airline_code, directions)
+
+
+def on_cluster_event(event: str, data):
+    """Слушатель событий координатора: загрузка, принятая другим воркером"""
+    if event == "upload":
+        _publish_if_subscribed(data["airline_code"], [tuple(pair) for pair in data["directions"]])
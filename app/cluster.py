@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+import socket
+from typing import Callable, Dict, List, Optional
+import asyncpg
+from DB.Database import db
+from DB.partitions import feature_key_ready, maintain_partitions
+from app.retention import ensure_rollup_table, run_retention_periodically
+from app.idempotency import ensure_upload_tables
+from app.serialization import dumps
+from utils import calculate_flight_direction, calculate_airline_punctuality, SNAPSHOT_FILES
+
+LEADER_LOCK_KEY = int(os.getenv('LEADER_LOCK_KEY', '824215'))
+LEADER_RETRY_SECONDS = float(os.getenv('LEADER_RETRY_SECONDS', '30'))
+AGGREGATES_REFRESH_SECONDS = float(os.getenv('AGGREGATES_REFRESH_SECONDS', '0'))
+SNAPSHOT_WAIT_SECONDS = float(os.getenv('SNAPSHOT_WAIT_SECONDS', '120'))
+MULTI_WORKER = int(os.getenv('WORKERS', '1')) > 1
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+SNAPSHOTS_CHANNEL = 'punctuality_snapshots'
+EVENTS_CHANNEL = 'punctuality_events'
+# Лимит полезной нагрузки NOTIFY — 8000 байт
+NOTIFY_LIMIT = 7900
+
+
+async def refresh_aggregates(pool) -> bool:
+    directions = await calculate_flight_direction(pool)
+    airlines = await calculate_airline_punctuality(pool)
+    return directions and airlines
+
+
+class Coordinator:
+    """
+    Координация воркеров: лидер (advisory lock в Postgres) считает агрегаты и выполняет
+    фоновые задачи, остальные читают общие снимки и получают события об их обновлении.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.conn: Optional[asyncpg.Connection] = None
+        self.is_leader = False
+        self.tasks: List[asyncio.Task] = []
+        self.leader_tasks: List[asyncio.Task] = []
+        self.snapshot_listeners: List[Callable] = []
+        self.event_listeners: List[Callable] = []
+        self._snapshots_ready = asyncio.Event()
+        self._campaign_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self):
+        await self._connect()
+        # Загрузка и выборки с признаками соединяют таблицы по flight_features.plan_departure
+        if not await feature_key_ready(self.conn):
+            self._stopping = True
+            await self.conn.close()
+            raise RuntimeError(
+                "flight_features.plan_departure отсутствует или не заполнен: "
+                "выполните python -m DB.partitions feature-key (или migrate)"
+            )
+
+        if await self._try_lead():
+            await self._become_leader(compute=True)
+        else:
+            self._start_campaign()
+            if not all(os.path.exists(path) for path in SNAPSHOT_FILES):
+                try:
+                    await asyncio.wait_for(self._snapshots_ready.wait(), SNAPSHOT_WAIT_SECONDS)
+                except asyncio.TimeoutError:
+                    print("Снимки агрегатов не получены от лидера, продолжаем без них")
+
+    async def stop(self):
+        self._stopping = True
+        for task in self.tasks + self.leader_tasks:
+            task.cancel()
+        if self._campaign_task:
+            self._campaign_task.cancel()
+        if self.conn and not self.conn.is_closed():
+            # Закрытие сессии освобождает advisory lock
+            await self.conn.close()
+
+    async def _connect(self):
+        self.conn = await asyncpg.connect(self.dsn)
+        self.conn.add_termination_listener(self._on_terminated)
+        await self.conn.add_listener(SNAPSHOTS_CHANNEL, self._on_snapshots)
+        await self.conn.add_listener(EVENTS_CHANNEL, self._on_event)
+
+    def _on_terminated(self, connection):
+        """
+        Соединение с блокировкой и LISTEN потеряно: Postgres уже отпустил advisory lock,
+        поэтому лидер немедленно слагает полномочия, чтобы не стало двух лидеров.
+        """
+        if self._stopping or connection is not self.conn:
+            return
+        if self.is_leader:
+            print(f"Воркер {NODE_ID} потерял соединение координатора и перестал быть лидером")
+            self.is_leader = False
+            for task in self.leader_tasks:
+                task.cancel()
+            self.leader_tasks = []
+        self.tasks.append(asyncio.get_running_loop().create_task(self._reconnect()))
+
+    async def _reconnect(self):
+        while not self._stopping:
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+            try:
+                await self._connect()
+            except Exception as e:
+                print(f"Error in coordinator reconnect: {e}")
+                continue
+            # Пока соединения не было, оповещения могли потеряться — перечитываем снимки
+            self._notify_local_snapshots()
+            self._start_campaign()
+            return
+
+    def _start_campaign(self):
+        if self._campaign_task is None or self._campaign_task.done():
+            self._campaign_task = asyncio.get_running_loop().create_task(self._campaign())
+
+    async def _try_lead(self) -> bool:
+        return await self.conn.fetchval("SELECT pg_try_advisory_lock($1)", LEADER_LOCK_KEY)
+
+    async def _campaign(self):
+        """Ведомый воркер периодически пытается стать лидером, если прежний лидер завершился"""
+        while not self.is_leader and not self.conn.is_closed():
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+            try:
+                if await self._try_lead():
+                    await self._become_leader(compute=not all(os.path.exists(p) for p in SNAPSHOT_FILES))
+            except Exception as e:
+                print(f"Error in leader election: {e}")
+
+    async def _become_leader(self, compute: bool):
+        self.is_leader = True
+        print(f"Воркер {NODE_ID} стал лидером")
+        async with db.connection() as conn:
+            await ensure_rollup_table(conn)
+            await ensure_upload_tables(conn)
+        if compute:
+            await self.publish_snapshots()
+        self.leader_tasks.append(asyncio.create_task(maintain_partitions(db.pool)))
+        self.leader_tasks.append(asyncio.create_task(run_retention_periodically(db.pool)))
+        if AGGREGATES_REFRESH_SECONDS > 0:
+            self.leader_tasks.append(asyncio.create_task(self._refresh_periodically()))
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(AGGREGATES_REFRESH_SECONDS)
+            try:
+                await self.publish_snapshots()
+            except Exception as e:
+                print(f"Error in aggregates refresh: {e}")
+
+    async def publish_snapshots(self):
+        """Пересчитывает агрегаты и оповещает остальные воркеры"""
+        if await refresh_aggregates(db.pool):
+            self._snapshots_ready.set()
+            self._notify_local_snapshots()
+            await db.execute("SELECT pg_notify($1, $2)", SNAPSHOTS_CHANNEL, NODE_ID)
+
+    def _notify_local_snapshots(self):
+        for listener in self.snapshot_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error in snapshot listener: {e}")
+
+    def _on_snapshots(self, connection, pid, channel, payload):
+        self._snapshots_ready.set()
+        if payload != NODE_ID:
+            self._notify_local_snapshots()
+
+    async def publish_event(self, event: str, data: Dict) -> bool:
+        """Рассылает событие другим воркерам; False, если оно не помещается в NOTIFY"""
+        payload = dumps({"node": NODE_ID, "event": event, "data": data})
+        if len(payload) > NOTIFY_LIMIT:
+            return False
+        await db.execute("SELECT pg_notify($1, $2)", EVENTS_CHANNEL, payload.decode('utf-8'))
+        return True
+
+    def _on_event(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        if message["node"] == NODE_ID:
+            return
+        for listener in self.event_listeners:
+            try:
+                listener(message["event"], message["data"])
+            except Exception as e:
+                print(f"Error in event listener: {e}")
+
+
+coordinator: Optional[Coordinator] = None
@@ -0,0 +1,166 @@
+import ast
+import csv
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+from app.features import DELAY_CATEGORIES, day_of_week, time_of_day, season
+from app.idempotency import as_utc
+
+RULES_FILE = 'resources/flight_delay_rules.csv'
+
+# Столбцы flight_features, известные до вылета (delay_category — то, что предсказываем)
+FEATURE_COLUMNS = (
+    "airline_iata_code", "departure_airport", "arrival_airport",
+    "day_of_week", "time_of_day", "season",
+)
+DELAY_LABELS = [label for _, label in DELAY_CATEGORIES]
+NO_DELAY = DELAY_LABELS[0]
+
+
+def _parse_itemset(value: str) -> frozenset:
+    """Разбирает frozenset({'col=val', ...}), как его записывает pandas.to_csv"""
+    value = value.strip()
+    if value.startswith("frozenset(") and value.endswith(")"):
+        value = value[len("frozenset("):-1]
+    return frozenset(ast.literal_eval(value)) if value else frozenset()
+
+
+def flight_features(airline: str, departure_airport: str, arrival_airport: str,
+                    plan_departure: datetime, tz_name: Optional[str] = None) -> Dict[str, str]:
+    """
+    Категории как в flight_features: время берётся местное для аэропорта вылета.
+    Время без зоны трактуется так же, как при загрузке в /upload (локальное время хоста)
+    """
+    plan_departure = as_utc(plan_departure)
+    try:
+        local = plan_departure.astimezone(ZoneInfo(tz_name or 'UTC'))
+    except (KeyError, ValueError):
+        local = plan_departure.astimezone(timezone.utc)
+    return {
+        "airline_iata_code": airline,
+        "departure_airport": departure_airport,
+        "arrival_airport": arrival_airport,
+        "day_of_week": day_of_week(local),
+        "time_of_day": time_of_day(local),
+        "season": season(local),
+    }
+
+
+class DelayRuleMatcher:
+    """
+    Правила из flight_delay_rules.csv, скомпилированные в битовые маски.
+    У рейса шесть признаков, поэтому подходящие правила находятся перебором
+    не более 63 подмасок признаков рейса со словарным поиском по каждой.
+    """
+
+    def __init__(self):
+        self.items: Dict[str, int] = {}
+        self.rules: List[dict] = []
+        self.by_mask: Dict[int, List[int]] = {}
+        self.priors: Dict[str, float] = {}
+        self.mtime: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.mtime is not None
+
+    def load(self, path: str = RULES_FILE):
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            rows = list(csv.DictReader(file))
+        self.build(rows)
+        self.mtime = os.path.getmtime(path)
+
+    def refresh_if_stale(self, path: str = RULES_FILE):
+        """Перекомпилирует правила, если файл перезаписан анализом"""
+        if not os.path.exists(path):
+            return
+        if self.mtime != os.path.getmtime(path):
+            self.load(path)
+
+    def build(self, rows: List[dict]):
+        items: Dict[str, int] = {}
+        rules: List[dict] = []
+        by_mask: Dict[int, List[int]] = {}
+        priors: Dict[str, float] = {}
+
+        for row in rows:
+            antecedents = _parse_itemset(row["antecedents"])
+            consequents = _parse_itemset(row["consequents"])
+            # Уверенность правила {A} -> {delay_category=X, B} относится к совместному событию,
+            # а не к категории X; правила с задержкой в условии к планируемому рейсу неприменимы
+            if len(consequents) != 1 or any(item.startswith("delay_category=") for item in antecedents):
+                continue
+            (consequent,) = consequents
+            if not consequent.startswith("delay_category="):
+                continue
+            category = consequent.split("=", 1)[1]
+            if row.get("consequent support"):
+                priors[category] = float(row["consequent support"])
+
+            mask = 0
+            for item in antecedents:
+                if item not in items:
+                    items[item] = 1 << len(items)
+                mask |= items[item]
+            by_mask.setdefault(mask, []).append(len(rules))
+            rules.append({
+                "rule": row.get("formatted_rule"),
+                "category": category,
+                "support": float(row["support"]),
+                "confidence": float(row["confidence"]),
+                "lift": float(row["lift"]),
+            })
+
+        self.items, self.rules, self.by_mask, self.priors = items, rules, by_mask, priors
+
+    def mask(self, features: Dict[str, str]) -> int:
+        mask = 0
+        for column in FEATURE_COLUMNS:
+            bit = self.items.get(f"{column}={features[column]}")
+            if bit:
+                mask |= bit
+        return mask
+
+    def matching_rules(self, mask: int) -> List[int]:
+        matched = []
+        submask = mask
+        while submask:
+            matched.extend(self.by_mask.get(submask, ()))
+            submask = (submask - 1) & mask
+        return matched
+
+    def score(self, mask: int) -> Dict:
+        """
+        Вероятность каждой категории — наибольшая уверенность среди сработавших правил,
+        а без них — априорная частота; остаток приходится на отсутствие задержки.
+        """
+        matched = self.matching_rules(mask)
+        probabilities = {label: self.priors.get(label, 0.0) for label in DELAY_LABELS[1:]}
+        best = {}
+        for index in matched:
+            rule = self.rules[index]
+            if rule["confidence"] > best.get(rule["category"], -1.0):
+                best[rule["category"]] = rule["confidence"]
+        probabilities.update(best)
+
+        delayed = sum(probabilities.values())
+        probabilities[NO_DELAY] = max(0.0, 1.0 - delayed)
+        total = sum(probabilities.values()) or 1.0
+        probabilities = {label: round(probabilities[label] / total, 4) for label in DELAY_LABELS}
+
+        return {
+            "probabilities": probabilities,
+            "category": max(probabilities, key=probabilities.get),
+            "matched": matched,
+        }
+
+    def explain(self, matched: List[int], limit: int = 3) -> List[dict]:
+        top = sorted(matched, key=lambda i: (self.rules[i]["lift"], self.rules[i]["confidence"]), reverse=True)
+        return [
+            {key: self.rules[i][key] for key in ("rule", "confidence", "lift")}
+            for i in top[:limit]
+        ]
+
+
+rule_matcher = DelayRuleMatcher()
@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Метки категорий должны совпадать с теми, что ожидает format_rule
+DAYS_OF_WEEK = {
+    1: 'Понедельник',
+    2: 'Вторник',
+    3: 'Среда',
+    4: 'Четверг',
+    5: 'Пятница',
+    6: 'Суббота',
+    7: 'Воскресенье',
+}
+
+# (час начала включительно, час конца не включительно, метка)
+TIMES_OF_DAY = [
+    (0, 6, 'Ночь'),
+    (6, 12, 'Утро'),
+    (12, 18, 'День'),
+    (18, 24, 'Вечер'),
+]
+
+SEASONS = {
+    12: 'Зима', 1: 'Зима', 2: 'Зима',
+    3: 'Весна', 4: 'Весна', 5: 'Весна',
+    6: 'Лето', 7: 'Лето', 8: 'Лето',
+    9: 'Осень', 10: 'Осень', 11: 'Осень',
+}
+
+# (верхняя граница задержки прибытия в минутах включительно, метка)
+DELAY_CATEGORIES = [
+    (15, 'Нет_задержки'),
+    (60, 'Короткая'),
+    (120, 'Средняя'),
+    (360, 'Длинная'),
+    (None, 'Очень_длинная'),
+]
+
+
+def _case(expr: str, mapping: dict) -> str:
+    branches = " ".join(f"WHEN {key} THEN '{label}'" for key, label in mapping.items())
+    return f"CASE {expr} {branches} END"
+
+
+def _time_of_day_case(expr: str) -> str:
+    branches = " ".join(
+        f"WHEN {expr} >= {start} AND {expr} < {end} THEN '{label}'"
+        for start, end, label in TIMES_OF_DAY
+    )
+    return f"CASE {branches} END"
+
+
+def _delay_case(expr: str) -> str:
+    branches = []
+    for upper, label in DELAY_CATEGORIES:
+        if upper is None:
+            branches.append(f"ELSE '{label}'")
+        else:
+            branches.append(f"WHEN {expr} <= {upper} THEN '{label}'")
+    return f"CASE WHEN {expr} IS NULL THEN NULL {' '.join(branches)} END"
+
+
+def _derive_sql(where: str) -> str:
+    """Один INSERT ... SELECT: признаки считаются в Postgres для всей пачки сразу"""
+    return f"""
+        WITH src AS (
+            SELECT
+                f.id,
+                f.plan_departure,
+                f.iata_code,
+                f.departure_airport,
+                f.arrival_airport,
+                f.plan_departure AT TIME ZONE COALESCE(ap.timezone, 'UTC') AS local_departure,
+                EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival)) / 60 AS delay_minutes
+            FROM flights f
+            LEFT JOIN airports ap ON ap.iata_code = f.departure_airport
+            WHERE {where}
+        )
+        INSERT INTO flight_features (
+            flight_id, plan_departure, airline_iata_code,
+            departure_airport, arrival_airport,
+            day_of_week, time_of_day, season, delay_category
+        )
+        SELECT
+            id, plan_departure, iata_code,
+            departure_airport, arrival_airport,
+            {_case("EXTRACT(ISODOW FROM local_departure)::int", DAYS_OF_WEEK)},
+            {_time_of_day_case("EXTRACT(HOUR FROM local_departure)::int")},
+            {_case("EXTRACT(MONTH FROM local_departure)::int", SEASONS)},
+            {_delay_case("delay_minutes")}
+        FROM src
+    """
+
+
+_DERIVE_BY_IDS = _derive_sql("f.id = ANY($1::bigint[])")
+_DERIVE_BY_RANGE = _derive_sql("f.plan_departure >= $1 AND f.plan_departure < $2")
+
+
+def day_of_week(dt: datetime) -> str:
+    return DAYS_OF_WEEK[dt.isoweekday()]
+
+
+def time_of_day(dt: datetime) -> str:
+    for start, end, label in TIMES_OF_DAY:
+        if start <= dt.hour < end:
+            return label
+
+
+def season(dt: datetime) -> str:
+    return SEASONS[dt.month]
+
+
+async def derive_flight_features(conn, flight_ids: Iterable[int]) -> int:
+    """Пересчитывает flight_features для переданных рейсов одной пачкой"""
+    ids = list(set(flight_ids))
+    if not ids:
+        return 0
+
+    async with conn.transaction():
+        await conn.execute(
+            "DELETE FROM flight_features WHERE flight_id = ANY($1::bigint[])",
+            ids
+        )
+        result = await conn.execute(_DERIVE_BY_IDS, ids)
+    return int(result.split()[-1])
+
+
+async def derive_flight_features_range(conn, start: datetime, end: datetime) -> int:
+    """Пересчитывает flight_features для рейсов с plan_departure в [start, end)"""
+    async with conn.transaction():
+        await conn.execute(
+            """
+            DELETE FROM flight_features
+            WHERE plan_departure >= $1 AND plan_departure < $2
+            """,
+            start, end
+        )
+        result = await conn.execute(_DERIVE_BY_RANGE, start, end)
+    return int(result.split()[-1])
+
+
+def split_range(date_from: date, date_to: date, chunk_days: int) -> List[tuple]:
+    """Делит [date_from, date_to] на полуинтервалы по chunk_days дней"""
+    chunks = []
+    current = date_from
+    while current <= date_to:
+        upper = min(current + timedelta(days=chunk_days), date_to + timedelta(days=1))
+        chunks.append((
+            datetime.combine(current, time.min),
+            datetime.combine(upper, time.min),
+        ))
+        current = upper
+    return chunks
+
+
+async def backfill(dsn: str, date_from: date, date_to: date, chunk_days: int = 7, workers: int = 4) -> int:
+    chunks = split_range(date_from, date_to, chunk_days)
+    pool = await asyncpg.create_pool(dsn, min_size=1, max_size=workers)
+    total = 0
+
+    async def run_chunk(start: datetime, end: datetime):
+        nonlocal total
+        async with pool.acquire() as conn:
+            count = await derive_flight_features_range(conn, start, end)
+        total += count
+        print(f"{start:%Y-%m-%d} — {end:%Y-%m-%d}: {count} рейсов")
+
+    try:
+        await asyncio.gather(*(run_chunk(start, end) for start, end in chunks))
+    finally:
+        await pool.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заполнение flight_features за исторический период")
+    parser.add_argument("--date-from", type=date.fromisoformat, required=True)
+    parser.add_argument("--date-to", type=date.fromisoformat, required=True)
+    parser.add_argument("--chunk-days", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dsn", default=os.getenv('DB_DSN'))
+    args = parser.parse_args()
+
+    total = asyncio.run(backfill(args.dsn, args.date_from, args.date_to, args.chunk_days, args.workers))
+    print(f"Всего обработано рейсов: {total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+UPLOAD_KEYS_TTL_HOURS = int(os.getenv('UPLOAD_KEYS_TTL_HOURS', '168'))
+# Заявка без результата старше этого срока считается брошенной (воркер убит, запрос отменён)
+UPLOAD_CLAIM_LEASE_MINUTES = int(os.getenv('UPLOAD_CLAIM_LEASE_MINUTES', '10'))
+
+UPLOAD_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS upload_batches (
+        airline_iata_code VARCHAR(3) NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        batch_hash BYTEA NOT NULL,
+        result JSONB,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (airline_iata_code, idempotency_key)
+    );
+    CREATE INDEX IF NOT EXISTS upload_batches_created_idx
+        ON upload_batches (airline_iata_code, created_at);
+"""
+
+EXISTING_FLIGHTS_QUERY = """
+    SELECT f.id, f.flight, f.plan_departure, f.content_hash
+    FROM flights f
+    JOIN unnest($2::text[], $3::timestamptz[]) AS k(flight, plan_departure)
+        ON f.flight = k.flight AND f.plan_departure = k.plan_departure
+    WHERE f.iata_code = $1
+"""
+
+# Ключ рейса и то, что перезаписывает повторная загрузка: хеш описывает ровно хранимые значения
+HASHED_FIELDS = ("flight", "plan_departure", "fact_departure", "fact_arrival")
+
+
+async def ensure_upload_tables(conn):
+    # ALTER TABLE берёт ACCESS EXCLUSIVE на flights и все секции даже при IF NOT EXISTS,
+    # поэтому столбец добавляется, только если его действительно нет
+    has_hash = await conn.fetchval(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'flights' AND column_name = 'content_hash'
+        )
+        """
+    )
+    if not has_hash:
+        await conn.execute("ALTER TABLE flights ADD COLUMN content_hash BYTEA")
+    await conn.execute(UPLOAD_TABLES_SQL)
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Наивное время — локальное время хоста, как его кодирует asyncpg для timestamptz"""
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc)
+
+
+def row_key(flight: str, plan_departure: datetime) -> Tuple[str, datetime]:
+    return flight, as_utc(plan_departure)
+
+
+def content_hash(row: Dict) -> bytes:
+    """md5 канонического представления строки: совпадает только для неизменных рейсов"""
+    parts = []
+    for field in HASHED_FIELDS:
+        value = row[field]
+        if isinstance(value, datetime):
+            value = as_utc(value).isoformat()
+        parts.append("" if value is None else str(value))
+    return hashlib.md5("\x1f".join(parts).encode('utf-8')).digest()
+
+
+def batch_hash(row_hashes: Iterable[bytes]) -> bytes:
+    return hashlib.sha256(b"".join(row_hashes)).digest()
+
+
+async def fetch_existing(conn, airline_code: str, keys: List[Tuple[str, datetime]]) -> Dict:
+    """Все уже загруженные рейсы пачки одним запросом: ключ -> (id, content_hash)"""
+    if not keys:
+        return {}
+    rows = await conn.fetch(
+        EXISTING_FLIGHTS_QUERY,
+        airline_code,
+        [flight for flight, _ in keys],
+        [plan_departure for _, plan_departure in keys]
+    )
+    return {
+        row_key(row["flight"], row["plan_departure"]): (row["id"], row["content_hash"])
+        for row in rows
+    }
+
+
+async def claim_batch(conn, airline_code: str, key: str, digest: bytes) -> Optional[Dict]:
+    """
+    Регистрирует ключ идемпотентности. None — пачку нужно обработать,
+    иначе запись о ранее принятой пачке с тем же ключом.
+    """
+    await conn.execute(
+        "DELETE FROM upload_batches WHERE airline_iata_code = $1 AND created_at < now() - make_interval(hours => $2)",
+        airline_code, UPLOAD_KEYS_TTL_HOURS
+    )
+    # Брошенную заявку на ту же пачку можно перехватить, иначе клиент получал бы 409 до истечения TTL
+    claimed = await conn.fetchval(
+        """
+        INSERT INTO upload_batches (airline_iata_code, idempotency_key, batch_hash)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (airline_iata_code, idempotency_key) DO UPDATE
+        SET created_at = now()
+        WHERE upload_batches.result IS NULL
+        AND upload_batches.batch_hash = EXCLUDED.batch_hash
+        AND upload_batches.created_at < now() - make_interval(mins => $4)
+        RETURNING true
+        """,
+        airline_code, key, digest, UPLOAD_CLAIM_LEASE_MINUTES
+    )
+    if claimed:
+        return None
+    row = await conn.fetchrow(
+        "SELECT batch_hash, result FROM upload_batches WHERE airline_iata_code = $1 AND idempotency_key = $2",
+        airline_code, key
+    )
+    if row is None:
+        return None
+    return {
+        "same_batch": bytes(row["batch_hash"]) == digest,
+        "result": json.loads(row["result"]) if row["result"] is not None else None,
+    }
+
+
+async def complete_batch(conn, airline_code: str, key: str, result: Dict):
+    await conn.execute(
+        "UPDATE upload_batches SET result = $3::jsonb WHERE airline_iata_code = $1 AND idempotency_key = $2",
+        airline_code, key, json.dumps(result, ensure_ascii=False)
+    )
+
+
+async def release_batch(conn, airline_code: str, key: str):
+    await conn.execute(
+        "DELETE FROM upload_batches WHERE airline_iata_code = $1 AND idempotency_key = $2 AND result IS NULL",
+        airline_code, key
+    )
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import re
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+import asyncpg
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Время в БД и ожидание пула, накопленные в рамках текущего HTTP-запроса
+_request_timings: ContextVar[Optional[list]] = ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: Dict[str, Dict[Tuple, Histogram]] = {}
+        self.counters: Dict[str, Dict[Tuple, float]] = {}
+        self.help: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self.queries: Dict[str, str] = {}
+        # Метки всех рядов процесса. Реестр у каждого воркера свой, а /metrics отвечает
+        # случайный воркер, поэтому ряды различаются меткой worker (сумма — sum by (...))
+        self.const_labels: Dict[str, str] = {}
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.help[name] = (help_text, labels)
+        self.histograms[name] = {}
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.help[name] = (help_text, labels)
+        self.counters[name] = {}
+
+    def observe(self, name: str, value: float, *labels):
+        series = self.histograms[name]
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, *labels):
+        series = self.counters[name]
+        series[labels] = series.get(labels, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        const_names = tuple(self.const_labels)
+        const_values = tuple(self.const_labels.values())
+        for name, series in self.counters.items():
+            help_text, label_names = self.help[name]
+            label_names = const_names + label_names
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_labels(label_names, const_values + labels)} {value}")
+        for name, series in self.histograms.items():
+            help_text, label_names = self.help[name]
+            label_names = const_names + label_names
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                labels = const_values + labels
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_labels(label_names + ('le',), labels + (str(bound),))} {cumulative}"
+                    )
+                lines.append(
+                    f"{name}_bucket{_labels(label_names + ('le',), labels + ('+Inf',))} {histogram.count}"
+                )
+                lines.append(f"{name}_sum{_labels(label_names, labels)} {histogram.total}")
+                lines.append(f"{name}_count{_labels(label_names, labels)} {histogram.count}")
+        for query_id, sql in self.queries.items():
+            lines.append(f"# query {query_id}: {sql[:200]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+registry = Registry()
+registry.counter("http_requests_total", "HTTP-запросы", ("method", "route", "status"))
+registry.histogram("http_request_duration_seconds", "Полное время обработки запроса", ("method", "route"))
+registry.histogram("http_request_db_seconds", "Время запросов к БД внутри HTTP-запроса", ("method", "route"))
+registry.histogram("http_request_pool_wait_seconds", "Ожидание соединения из пула внутри HTTP-запроса", ("method", "route"))
+registry.histogram("db_pool_acquire_seconds", "Ожидание соединения из пула")
+registry.histogram("db_query_duration_seconds", "Время выполнения SQL", ("query",))
+registry.counter("db_query_rows_total", "Строки, возвращённые SQL", ("query",))
+registry.counter("db_query_errors_total", "Ошибки SQL", ("query",))
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![$\w])\d+(?:\.\d+)?\b")
+_query_ids: Dict[str, str] = {}
+
+
+def normalize_sql(query: str) -> str:
+    return _LITERALS.sub("?", _WHITESPACE.sub(" ", query).strip())
+
+
+def query_id(query: str) -> str:
+    """Короткий идентификатор запроса для меток (кешируется по тексту SQL)"""
+    qid = _query_ids.get(query)
+    if qid is None:
+        normalized = normalize_sql(query)
+        qid = hashlib.md5(normalized.encode()).hexdigest()[:10]
+        _query_ids[query] = qid
+        registry.queries[qid] = normalized
+    return qid
+
+
+def record_pool_wait(seconds: float):
+    registry.observe("db_pool_acquire_seconds", seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[1] += seconds
+
+
+def _record_query(query: str, seconds: float, rows: int, failed: bool):
+    qid = query_id(query)
+    registry.observe("db_query_duration_seconds", seconds, qid)
+    if rows:
+        registry.inc("db_query_rows_total", rows, qid)
+    if failed:
+        registry.inc("db_query_errors_total", 1, qid)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[0] += seconds
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        print(f"Slow query {qid} ({seconds * 1000:.1f} ms, {rows} rows): {registry.queries[qid]}")
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    """Соединение asyncpg, замеряющее время и число строк каждого запроса"""
+
+    async def _timed(self, method, query, args, kwargs, count):
+        started = time.perf_counter()
+        failed = False
+        result = None
+        try:
+            result = await method(query, *args, **kwargs)
+            return result
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _record_query(query, time.perf_counter() - started, count(result), failed)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self._timed(super().fetch, query, args, kwargs, lambda r: len(r) if r else 0)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self._timed(super().fetchrow, query, args, kwargs, lambda r: 1 if r is not None else 0)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self._timed(super().fetchval, query, args, kwargs, lambda r: 1 if r is not None else 0)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self._timed(super().execute, query, args, kwargs, lambda r: 0)
+
+
+class MetricsMiddleware:
+    """ASGI-мидлварь: время запроса по шаблону маршрута, время в БД и ожидание пула"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        timings = [0.0, 0.0]
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_timings.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            registry.inc("http_requests_total", 1, method, path, status[0])
+            registry.observe("http_request_duration_seconds", elapsed, method, path)
+            registry.observe("http_request_db_seconds", timings[0], method, path)
+            registry.observe("http_request_pool_wait_seconds", timings[1], method, path)
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Метрики только ответившего воркера (метка worker). При --workers N каждый опрос попадает
+    в случайный воркер: ряды остаются монотонными по отдельности, полная картина — через sum by
+    по всем воркерам, а гарантированно каждый воркер опрашивается, только если слушает свой порт.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,176 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+from fastapi import Depends, HTTPException, Request, status
+from DB.Database import db
+
+WORKERS = max(1, int(os.getenv('WORKERS', '1')))
+MAX_BUCKETS = 10_000
+# Сколько прокси перед приложением дописывают адрес в X-Forwarded-For (root_path="/api" — за прокси)
+FORWARDED_HOPS = int(os.getenv('FORWARDED_HOPS', '1'))
+# Сколько ждать соединения для проверок до допуска (токен /upload), прежде чем ответить 503
+POOL_ACQUIRE_TIMEOUT = float(os.getenv('POOL_ACQUIRE_TIMEOUT', '0.5'))
+
+# Класс маршрутов: "запросов в секунду,запас (burst),одновременных запросов на воркер"
+DEFAULT_LIMITS = {
+    "upload": "2,10,4",
+    "heavy": "5,20,6",
+    "refresh": "0.0167,1,1",
+}
+
+
+class RouteLimits:
+    def __init__(self, spec: str, pool_guard: bool = True):
+        rate, burst, concurrency = spec.split(",")
+        # Лимит задаётся на весь сервис, поэтому делится между воркерами
+        self.rate = float(rate) / WORKERS
+        self.burst = max(1.0, float(burst) / WORKERS)
+        self.concurrency = int(concurrency)
+        self.pool_guard = pool_guard
+
+
+class Limiter:
+    """Token bucket по ключу плюс неблокирующий лимит одновременных запросов"""
+
+    def __init__(self, name: str, limits: RouteLimits):
+        self.name = name
+        self.limits = limits
+        self.buckets: Dict[str, list] = {}
+        self.in_flight = 0
+
+    def take(self, key: str) -> Optional[float]:
+        """Списывает токен; при нехватке возвращает, через сколько секунд он появится"""
+        now = time.monotonic()
+        # pop + вставка держат словарь в порядке последнего обращения
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            bucket = [self.limits.burst, now]
+        self.buckets[key] = bucket
+        tokens = min(self.limits.burst, bucket[0] + (now - bucket[1]) * self.limits.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return None
+        bucket[0] = tokens
+        return (1 - tokens) / self.limits.rate if self.limits.rate > 0 else 60.0
+
+    def _prune(self, now: float):
+        """Удаляет восстановившиеся корзины, а если их мало — давно не использованные"""
+        for key, (tokens, updated) in list(self.buckets.items()):
+            if tokens + (now - updated) * self.limits.rate >= self.limits.burst:
+                del self.buckets[key]
+        while len(self.buckets) >= MAX_BUCKETS:
+            del self.buckets[next(iter(self.buckets))]
+
+
+class Lease:
+    """Занятое место в лимите одновременных запросов; release идемпотентен"""
+
+    def __init__(self, limiter: Limiter):
+        self.limiter = limiter
+        self.active = True
+        self.detached = False
+        limiter.in_flight += 1
+
+    def release(self):
+        if self.active:
+            self.active = False
+            self.limiter.in_flight -= 1
+
+    def detach(self) -> "Lease":
+        """Место освободит сам ответ (потоковый), а не выход из зависимости"""
+        self.detached = True
+        return self
+
+
+limiters = {
+    name: Limiter(name, RouteLimits(os.getenv(f"RATE_LIMIT_{name.upper()}", spec)))
+    for name, spec in DEFAULT_LIMITS.items()
+}
+
+
+def _pool_exhausted() -> bool:
+    pool = db.pool
+    if pool is None:
+        return False
+    return pool.get_idle_size() == 0 and pool.get_size() >= pool.get_max_size()
+
+
+def client_address(request: Request) -> str:
+    """Адрес клиента: запись, добавленная нашим прокси в X-Forwarded-For, иначе адрес соединения"""
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and FORWARDED_HOPS > 0:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(FORWARDED_HOPS, len(hops))]
+    return request.client.host if request.client else "unknown"
+
+
+def _reject(status_code: int, detail: str, retry_after: float):
+    raise HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+@asynccontextmanager
+async def guarded_connection():
+    """Соединение для проверок до допуска: вместо очереди в пуле — сразу 503"""
+    if db.pool is None:
+        raise RuntimeError("Database not connected")
+    if _pool_exhausted():
+        _reject(status.HTTP_503_SERVICE_UNAVAILABLE, "Нет свободных соединений с БД", 1)
+    try:
+        conn = await db.pool.acquire(timeout=POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _reject(status.HTTP_503_SERVICE_UNAVAILABLE, "Нет свободных соединений с БД", 1)
+    try:
+        yield conn
+    finally:
+        await db.pool.release(conn)
+
+
+def admission(route_class: str, key_dependency: Optional[Callable] = None):
+    """
+    Зависимость FastAPI: отказывает сразу (429/503 с Retry-After), а не ждёт соединения из пула.
+    Без key_dependency ключ — адрес клиента; для /upload — авиакомпания из проверенного токена,
+    иначе каждый выдуманный токен получал бы собственную корзину. key_dependency не должна
+    ждать пул: соединение запроса берётся только после допуска (см. guarded_connection).
+    Возвращает Lease; потоковые ответы забирают его через detach() и освобождают сами.
+    """
+    limiter = limiters[route_class]
+
+    async def admit(key: str):
+        retry_after = limiter.take(key)
+        if retry_after is not None:
+            _reject(status.HTTP_429_TOO_MANY_REQUESTS, "Превышен лимит запросов", retry_after)
+        if limiter.in_flight >= limiter.limits.concurrency:
+            _reject(status.HTTP_503_SERVICE_UNAVAILABLE, "Сервер перегружен, повторите позже", 1)
+        if limiter.limits.pool_guard and _pool_exhausted():
+            _reject(status.HTTP_503_SERVICE_UNAVAILABLE, "Нет свободных соединений с БД", 1)
+        return Lease(limiter)
+
+    if key_dependency is None:
+        async def dependency(request: Request):
+            lease = await admit(client_address(request))
+            try:
+                yield lease
+            finally:
+                if not lease.detached:
+                    lease.release()
+    else:
+        async def dependency(key: str = Depends(key_dependency)):
+            lease = await admit(f"key:{key}")
+            try:
+                yield lease
+            finally:
+                if not lease.detached:
+                    lease.release()
+
+    return dependency
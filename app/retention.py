@@ -0,0 +1,301 @@
+"""
+Хранение истории: рейсы старше горизонта сворачиваются в flight_rollups,
+выгружаются в Parquet и удаляются из flights.
+
+    python -m app.retention run --horizon-months 24
+"""
+import argparse
+import asyncio
+import glob
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterator, List, Optional
+import asyncpg
+from dotenv import load_dotenv
+from DB.partitions import add_months, month_start
+
+load_dotenv()
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive/flights')
+HORIZON_MONTHS = int(os.getenv('RETENTION_HORIZON_MONTHS', '0'))
+EXPORT_BATCH_SIZE = 100_000
+
+ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS flight_rollups (
+        month DATE NOT NULL,
+        iata_code VARCHAR(3) NOT NULL,
+        departure_airport VARCHAR(3) NOT NULL,
+        arrival_airport VARCHAR(3) NOT NULL,
+        total_flights BIGINT NOT NULL DEFAULT 0,
+        on_time_departures BIGINT NOT NULL DEFAULT 0,
+        on_time_arrivals BIGINT NOT NULL DEFAULT 0,
+        on_time_arrivals_abs BIGINT NOT NULL DEFAULT 0,
+        cancellations BIGINT NOT NULL DEFAULT 0,
+        missing_arrivals BIGINT NOT NULL DEFAULT 0,
+        arrival_delay_count BIGINT NOT NULL DEFAULT 0,
+        arrival_delay_minutes_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        departure_delay_0_10 BIGINT NOT NULL DEFAULT 0,
+        departure_delay_11_20 BIGINT NOT NULL DEFAULT 0,
+        departure_delay_21_30 BIGINT NOT NULL DEFAULT 0,
+        departure_delay_31_120 BIGINT NOT NULL DEFAULT 0,
+        departure_delay_over_120 BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, iata_code, departure_airport, arrival_airport)
+    )
+"""
+
+# Определения совпадают с агрегатами в utils.py и гистограммой в endpoints.py
+ROLLUP_SQL = """
+    INSERT INTO flight_rollups AS r
+    SELECT
+        $1::date AS month,
+        f.iata_code,
+        f.departure_airport,
+        f.arrival_airport,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE f.fact_departure IS NOT NULL
+                         AND EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) < 900),
+        COUNT(*) FILTER (WHERE f.fact_arrival IS NOT NULL
+                         AND EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival)) < 900),
+        COUNT(*) FILTER (WHERE f.fact_arrival IS NOT NULL
+                         AND ABS(EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival))) < 900),
+        COUNT(*) FILTER (WHERE f.fact_departure IS NULL),
+        COUNT(*) FILTER (WHERE f.fact_arrival IS NULL),
+        COUNT(f.fact_arrival),
+        COALESCE(SUM(EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival)) / 60), 0),
+        COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) <= 600),
+        COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) > 600
+                         AND EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) <= 1200),
+        COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) > 1200
+                         AND EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) <= 1800),
+        COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) > 1800
+                         AND EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) <= 7200),
+        COUNT(*) FILTER (WHERE EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) > 7200)
+    FROM flights f
+    WHERE f.plan_departure >= $2 AND f.plan_departure < $3
+    GROUP BY f.iata_code, f.departure_airport, f.arrival_airport
+    ON CONFLICT (month, iata_code, departure_airport, arrival_airport) DO UPDATE SET
+        total_flights = r.total_flights + EXCLUDED.total_flights,
+        on_time_departures = r.on_time_departures + EXCLUDED.on_time_departures,
+        on_time_arrivals = r.on_time_arrivals + EXCLUDED.on_time_arrivals,
+        on_time_arrivals_abs = r.on_time_arrivals_abs + EXCLUDED.on_time_arrivals_abs,
+        cancellations = r.cancellations + EXCLUDED.cancellations,
+        missing_arrivals = r.missing_arrivals + EXCLUDED.missing_arrivals,
+        arrival_delay_count = r.arrival_delay_count + EXCLUDED.arrival_delay_count,
+        arrival_delay_minutes_sum = r.arrival_delay_minutes_sum + EXCLUDED.arrival_delay_minutes_sum,
+        departure_delay_0_10 = r.departure_delay_0_10 + EXCLUDED.departure_delay_0_10,
+        departure_delay_11_20 = r.departure_delay_11_20 + EXCLUDED.departure_delay_11_20,
+        departure_delay_21_30 = r.departure_delay_21_30 + EXCLUDED.departure_delay_21_30,
+        departure_delay_31_120 = r.departure_delay_31_120 + EXCLUDED.departure_delay_31_120,
+        departure_delay_over_120 = r.departure_delay_over_120 + EXCLUDED.departure_delay_over_120
+"""
+
+EXPORT_COLUMNS = [
+    "id", "iata_code", "flight",
+    "departure_airport", "arrival_airport",
+    "plan_departure", "plan_arrival",
+    "fact_departure", "fact_arrival",
+]
+
+
+def _arrow_schema():
+    import pyarrow as pa
+    ts = pa.timestamp("us", tz="UTC")
+    return pa.schema([
+        ("id", pa.int64()),
+        ("iata_code", pa.string()),
+        ("flight", pa.string()),
+        ("departure_airport", pa.string()),
+        ("arrival_airport", pa.string()),
+        ("plan_departure", ts),
+        ("plan_arrival", ts),
+        ("fact_departure", ts),
+        ("fact_arrival", ts),
+    ])
+
+
+def month_dir(month: date) -> str:
+    return os.path.join(ARCHIVE_DIR, f"month={month:%Y-%m}")
+
+
+def archived_months() -> List[date]:
+    months = []
+    for path in glob.glob(os.path.join(ARCHIVE_DIR, "month=*")):
+        months.append(datetime.strptime(os.path.basename(path)[6:], "%Y-%m").date())
+    return sorted(months)
+
+
+async def ensure_rollup_table(conn):
+    await conn.execute(ROLLUP_TABLE_SQL)
+
+
+def _bounds(month: date):
+    start = datetime.combine(month, datetime.min.time(), tzinfo=timezone.utc)
+    end = datetime.combine(add_months(month, 1), datetime.min.time(), tzinfo=timezone.utc)
+    return start, end
+
+
+async def _export_month(conn, month: date, path: str) -> int:
+    """Выгружает рейсы месяца в Parquet курсором, не держа весь месяц в памяти (нужна открытая транзакция)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema()
+    start, end = _bounds(month)
+    exported = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        cursor = await conn.cursor(
+            f"""
+            SELECT {", ".join(EXPORT_COLUMNS)} FROM flights
+            WHERE plan_departure >= $1 AND plan_departure < $2
+            ORDER BY id
+            """,
+            start, end
+        )
+        while True:
+            rows = await cursor.fetch(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            columns = {name: [row[name] for row in rows] for name in EXPORT_COLUMNS}
+            writer.write_table(pa.table(columns, schema=schema))
+            exported += len(rows)
+    return exported
+
+
+async def _recover_pending(conn):
+    """Доводит или откатывает выгрузки, прерванные между записью файла и удалением строк"""
+    import pyarrow.parquet as pq
+
+    for pending in glob.glob(os.path.join(ARCHIVE_DIR, "month=*", "*.parquet.pending")):
+        try:
+            first_id = pq.read_table(pending, columns=["id"]).column("id")[0].as_py()
+        except Exception:
+            # Файл не дописан — транзакция точно не зафиксирована
+            os.remove(pending)
+            continue
+        still_hot = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM flights WHERE id = $1)", first_id)
+        if still_hot:
+            os.remove(pending)
+        else:
+            os.replace(pending, pending[:-len(".pending")])
+
+
+async def archive_month(conn, month: date) -> int:
+    """Свёртка, выгрузка в Parquet и удаление рейсов одного месяца"""
+    os.makedirs(month_dir(month), exist_ok=True)
+    final_path = os.path.join(month_dir(month), f"part-{time.time_ns()}.parquet")
+    pending_path = final_path + ".pending"
+    start, end = _bounds(month)
+
+    # REPEATABLE READ: выгрузка, свёртка и удаление видят один снимок,
+    # поэтому рейс, загруженный за этот месяц во время архивации, не потеряется
+    async with conn.transaction(isolation='repeatable_read'):
+        exported = await _export_month(conn, month, pending_path)
+        if not exported:
+            os.remove(pending_path)
+            return 0
+        await conn.execute(ROLLUP_SQL, month, start, end)
+        await conn.execute(
+            "DELETE FROM flight_features WHERE plan_departure >= $1 AND plan_departure < $2",
+            start, end
+        )
+        await conn.execute(
+            "DELETE FROM flights WHERE plan_departure >= $1 AND plan_departure < $2",
+            start, end
+        )
+    os.replace(pending_path, final_path)
+    return exported
+
+
+async def run_retention(conn, horizon_months: int) -> dict:
+    if horizon_months <= 0:
+        return {}
+    await ensure_rollup_table(conn)
+    await _recover_pending(conn)
+
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -horizon_months)
+    oldest = await conn.fetchval("SELECT MIN(plan_departure) FROM flights")
+    if oldest is None:
+        return {}
+
+    archived = {}
+    month = month_start(oldest)
+    while month < cutoff:
+        count = await archive_month(conn, month)
+        if count:
+            archived[f"{month:%Y-%m}"] = count
+            print(f"Архивирован {month:%Y-%m}: {count} рейсов")
+        month = add_months(month, 1)
+    return archived
+
+
+async def run_retention_periodically(pool, interval: float = 24 * 3600):
+    """Фоновая задача: раз в сутки переносит старые месяцы в архив"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with pool.acquire() as conn:
+                await run_retention(conn, HORIZON_MONTHS)
+        except Exception as e:
+            print(f"Error in run_retention: {e}")
+
+
+def read_archive(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    airline: Optional[str] = None,
+    batch_size: int = 10_000
+) -> Iterator[List[dict]]:
+    """Читает архивные рейсы пачками; фильтры применяются при чтении Parquet"""
+    import pyarrow.dataset as ds
+
+    months = [
+        m for m in archived_months()
+        if (date_from is None or add_months(m, 1) > date_from)
+        and (date_to is None or m <= date_to)
+    ]
+    paths = [
+        path
+        for m in months
+        for path in sorted(glob.glob(os.path.join(month_dir(m), "*.parquet")))
+    ]
+    if not paths:
+        return
+
+    dataset = ds.dataset(paths, schema=_arrow_schema(), format="parquet")
+    conditions = []
+    if date_from:
+        conditions.append(ds.field("plan_departure") >= datetime.combine(date_from, datetime.min.time(), tzinfo=timezone.utc))
+    if date_to:
+        conditions.append(ds.field("plan_departure") < datetime.combine(date_to + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc))
+    if airline:
+        conditions.append(ds.field("iata_code") == airline)
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+
+    for batch in dataset.to_batches(filter=condition, batch_size=batch_size):
+        yield batch.to_pylist()
+
+
+async def _run(dsn: str, horizon_months: int):
+    conn = await asyncpg.connect(dsn)
+    try:
+        archived = await run_retention(conn, horizon_months)
+        print(f"Месяцев архивировано: {len(archived)}")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Архивирование старых рейсов")
+    parser.add_argument("--dsn", default=os.getenv('DB_DSN'))
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Свернуть, выгрузить и удалить рейсы старше горизонта")
+    run_parser.add_argument("--horizon-months", type=int, default=HORIZON_MONTHS or 24)
+    args = parser.parse_args()
+    asyncio.run(_run(args.dsn, args.horizon_months))
+
+
+if __name__ == "__main__":
+    main()
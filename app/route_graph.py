@@ -0,0 +1,236 @@
+import asyncio
+import json
+import math
+import os
+from collections import deque
+from typing import Dict, List, Optional
+
+DIRECTIONS_FILE = 'data/flight_direction_stats.json'
+MAX_HOPS = 4
+
+
+class RouteGraph:
+    """Неориентированный граф аэропортов в формате CSR, построенный по агрегатам направлений"""
+
+    def __init__(self):
+        self.codes: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.indptr: List[int] = [0]
+        self.indices: List[int] = []
+        self.on_time: List[Optional[float]] = []
+        self.flights: List[int] = []
+        self.costs: List[float] = []
+        # 1 для рёбер без шанса прибыть вовремя (0 %) или без данных о прибытии
+        self.unreliable: List[int] = []
+        self.neighbours: List[List[dict]] = []
+        self.hubs: List[dict] = []
+        self.mtime: Optional[float] = None
+        self._refreshing = False
+
+    def load(self, path: str = DIRECTIONS_FILE):
+        with open(path, 'r', encoding='utf-8') as file:
+            directions = json.load(file)
+        self.build(directions)
+        self.mtime = os.path.getmtime(path)
+
+    def is_stale(self, path: str = DIRECTIONS_FILE) -> bool:
+        return os.path.exists(path) and self.mtime != os.path.getmtime(path)
+
+    async def refresh_if_stale(self, path: str = DIRECTIONS_FILE):
+        """
+        Перестраивает граф, если файл агрегатов обновился. Построение (с betweenness за O(V·E))
+        идёт в потоке, а готовые структуры подменяются в цикле событий целиком.
+        """
+        if self._refreshing or not self.is_stale(path):
+            return
+        self._refreshing = True
+        try:
+            fresh = RouteGraph()
+            await asyncio.to_thread(fresh.load, path)
+            self.__dict__.update(fresh.__dict__)
+        except Exception as e:
+            print(f"Error in route_graph refresh: {e}")
+        finally:
+            self._refreshing = False
+
+    def schedule_refresh(self):
+        """Слушатель обновления снимков: перестроение в фоне, без задержки запросов"""
+        asyncio.get_running_loop().create_task(self.refresh_if_stale())
+
+    def build(self, directions: List[dict]):
+        codes = sorted({
+            code
+            for row in directions
+            for code in (row["airport1"], row["airport2"])
+        })
+        index = {code: i for i, code in enumerate(codes)}
+
+        adjacency = [[] for _ in codes]
+        for row in directions:
+            a, b = index[row["airport1"]], index[row["airport2"]]
+            if a == b:
+                continue
+            # None — по направлению нет ни одного фактического прибытия
+            edge = (row.get("on_time_percentage"), row["total_flights"])
+            adjacency[a].append((b, *edge))
+            adjacency[b].append((a, *edge))
+
+        indptr, indices, on_time, flights, costs, unreliable = [0], [], [], [], [], []
+        for edges in adjacency:
+            edges.sort(key=lambda e: (-(e[1] if e[1] is not None else -1.0), -e[2]))
+            for target, percentage, total in edges:
+                indices.append(target)
+                on_time.append(percentage)
+                flights.append(total)
+                # Максимизация произведения вероятностей = минимизация суммы -log(p);
+                # у ненадёжных рёбер -log(p) бесконечен, они учитываются отдельным счётчиком
+                probability = percentage / 100 if percentage is not None else 0.0
+                costs.append(-math.log(probability) if probability > 0 else 0.0)
+                unreliable.append(0 if probability > 0 else 1)
+            indptr.append(len(indices))
+
+        self.codes, self.index = codes, index
+        self.indptr, self.indices = indptr, indices
+        self.on_time, self.flights, self.costs = on_time, flights, costs
+        self.unreliable = unreliable
+        self.neighbours = [
+            [
+                {
+                    "airport": codes[indices[j]],
+                    "on_time_percentage": on_time[j],
+                    "total_flights": flights[j],
+                }
+                for j in range(indptr[i], indptr[i + 1])
+            ]
+            for i in range(len(codes))
+        ]
+        self.hubs = self._rank_hubs()
+
+    def _rank_hubs(self) -> List[dict]:
+        n = len(self.codes)
+        betweenness = self._betweenness()
+        scale = (n - 1) * (n - 2) / 2 if n > 2 else 1
+        hubs = []
+        for i, code in enumerate(self.codes):
+            start, end = self.indptr[i], self.indptr[i + 1]
+            total = sum(self.flights[start:end])
+            known = [j for j in range(start, end) if self.on_time[j] is not None]
+            known_total = sum(self.flights[j] for j in known)
+            hubs.append({
+                "airport": code,
+                "degree": end - start,
+                "total_flights": total,
+                "weighted_on_time_percentage": round(
+                    sum(self.on_time[j] * self.flights[j] for j in known) / known_total, 1
+                ) if known_total else None,
+                "betweenness": round(betweenness[i] / scale, 6),
+            })
+        hubs.sort(key=lambda h: (-h["betweenness"], -h["degree"], -h["total_flights"]))
+        return hubs
+
+    def _betweenness(self) -> List[float]:
+        """Алгоритм Брандеса по невзвешенным рёбрам"""
+        n = len(self.codes)
+        centrality = [0.0] * n
+        for s in range(n):
+            stack = []
+            predecessors = [[] for _ in range(n)]
+            sigma = [0] * n
+            sigma[s] = 1
+            distance = [-1] * n
+            distance[s] = 0
+            queue = deque([s])
+            while queue:
+                v = queue.popleft()
+                stack.append(v)
+                for j in range(self.indptr[v], self.indptr[v + 1]):
+                    w = self.indices[j]
+                    if distance[w] < 0:
+                        distance[w] = distance[v] + 1
+                        queue.append(w)
+                    if distance[w] == distance[v] + 1:
+                        sigma[w] += sigma[v]
+                        predecessors[w].append(v)
+            delta = [0.0] * n
+            while stack:
+                w = stack.pop()
+                for v in predecessors[w]:
+                    delta[v] += sigma[v] / sigma[w] * (1 + delta[w])
+                if w != s:
+                    centrality[w] += delta[w]
+        # Граф неориентированный — каждый путь учтён дважды
+        return [c / 2 for c in centrality]
+
+    def best_connection(self, source: str, target: str, max_hops: int = 2) -> Optional[dict]:
+        """Самый пунктуальный маршрут не более чем из max_hops перелётов"""
+        if source not in self.index or target not in self.index:
+            return None
+        max_hops = min(max_hops, MAX_HOPS)
+        s, t = self.index[source], self.index[target]
+        n = len(self.codes)
+
+        # Беллман-Форд, ограниченный числом пересадок: слой h — лучшие пути ровно до h рёбер.
+        # Стоимость — (число ненадёжных рёбер, сумма -log(p)): маршрут через рейсы с 0 % или
+        # без данных возвращается, только если другого нет, и с вероятностью 0 (или None)
+        unreached = (math.inf, math.inf)
+        cost = [unreached] * n
+        cost[s] = (0, 0.0)
+        parents = []
+        for _ in range(max_hops):
+            next_cost = cost[:]
+            parent = [-1] * n
+            for v in range(n):
+                if cost[v] == unreached:
+                    continue
+                for j in range(self.indptr[v], self.indptr[v + 1]):
+                    w = self.indices[j]
+                    candidate = (cost[v][0] + self.unreliable[j], cost[v][1] + self.costs[j])
+                    if candidate < next_cost[w]:
+                        next_cost[w] = candidate
+                        parent[w] = v
+            parents.append(parent)
+            cost = next_cost
+
+        if cost[t] == unreached or s == t:
+            return None
+
+        path = [t]
+        node = t
+        for parent in reversed(parents):
+            if parent[node] != -1:
+                node = parent[node]
+                path.append(node)
+            if node == s:
+                break
+        path.reverse()
+
+        legs = []
+        for a, b in zip(path, path[1:]):
+            j = self._edge(a, b)
+            legs.append({
+                "from": self.codes[a],
+                "to": self.codes[b],
+                "on_time_percentage": self.on_time[j],
+                "total_flights": self.flights[j],
+            })
+        if any(leg["on_time_percentage"] is None for leg in legs):
+            probability = None
+        elif cost[t][0]:
+            probability = 0.0
+        else:
+            probability = round(math.exp(-cost[t][1]), 4)
+        return {
+            "path": [self.codes[i] for i in path],
+            "hops": len(legs),
+            "on_time_probability": probability,
+            "legs": legs,
+        }
+
+    def _edge(self, a: int, b: int) -> int:
+        for j in range(self.indptr[a], self.indptr[a + 1]):
+            if self.indices[j] == b:
+                return j
+        raise KeyError((a, b))
+
+
+route_graph = RouteGraph()
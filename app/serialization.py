@@ -0,0 +1,57 @@
+from decimal import Decimal
+from typing import Any
+import asyncpg
+import orjson
+from fastapi.responses import JSONResponse, Response
+
+
+def _default(obj: Any):
+    if isinstance(obj, asyncpg.Record):
+        return dict(obj)
+    if isinstance(obj, Decimal):
+        # Как decimal_encoder в FastAPI: целые значения остаются целыми
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    raise TypeError
+
+
+def dumps(content: Any, indent: bool = False) -> bytes:
+    """orjson с поддержкой asyncpg.Record и Decimal; datetime сериализуется нативно"""
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+    return orjson.dumps(content, default=_default, option=option)
+
+
+class ORJSONResponse(JSONResponse):
+    """Ответ по умолчанию для всех роутеров"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def records_response(rows) -> Response:
+    """
+    Сериализует список asyncpg.Record сразу в байты, минуя jsonable_encoder и pydantic.
+    Каждая запись всё же превращается в dict в default-хуке orjson.
+    """
+    return Response(content=dumps(rows), media_type="application/json")
+
+
+def raw_json_response(data) -> Response:
+    """Отдаёт уже готовый JSON (из json_agg или файла) без разбора"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return Response(content=data, media_type="application/json")
+
+
+async def fetch_json_array(conn, query: str, *args) -> Response:
+    """
+    Собирает результат запроса в JSON-массив на стороне Postgres.
+    json_agg выводит timestamptz в часовом поясе сессии, поэтому на время запроса
+    ставится UTC — формат совпадает с ответами, сериализованными orjson (+00:00).
+    """
+    async with conn.transaction():
+        await conn.execute("SET LOCAL TIME ZONE 'UTC'")
+        data = await conn.fetchval(
+            f"SELECT COALESCE(json_agg(q), '[]'::json) FROM ({query}) q",
+            *args
+        )
+    return raw_json_response(data)
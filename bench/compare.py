@@ -0,0 +1,55 @@
+"""
+Сравнение двух отчётов bench.load; код возврата 1 при регрессии p99 или пропускной способности.
+
+    python -m bench.compare baseline.json candidate.json --threshold 0.15
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as file:
+        return {r["scenario"]: r for r in json.load(file)["results"]}
+
+
+def _rejected(result: dict) -> int:
+    # В отчётах до учёта отказов поля rejected нет
+    return sum(result.get("rejected", {}).values())
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list:
+    regressions = []
+    for name, new in candidate.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        p99_ratio = new["latency_ms"]["p99"] / old["latency_ms"]["p99"] if old["latency_ms"]["p99"] else 1.0
+        rps_ratio = new["requests_per_s"] / old["requests_per_s"] if old["requests_per_s"] else 1.0
+        regressed = p99_ratio > 1 + threshold or rps_ratio < 1 - threshold
+        # p99 и rps считаются по успешным ответам; рост отказов лимитов показывается рядом
+        old_rejected, new_rejected = _rejected(old), _rejected(new)
+        print(
+            f"{name:<28} p99 {old['latency_ms']['p99']:>8} -> {new['latency_ms']['p99']:>8} ms ({p99_ratio:5.2f}x) "
+            f"rps {old['requests_per_s']:>8} -> {new['requests_per_s']:>8} ({rps_ratio:5.2f}x) "
+            f"429/503 {old_rejected} -> {new_rejected}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение отчётов нагрузочных прогонов")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    regressions = compare(load(args.baseline), load(args.candidate), args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Нагрузочный прогон API: задержки p50/p99, запросы и строки в секунду, память.
+Лимиты (app/rate_limit.py) быстро отвечают 429/503 — они считаются отдельно от задержек.
+Чтобы мерить сами обработчики, а не отказы, лимиты на время прогона поднимают:
+
+    RATE_LIMIT_UPLOAD=1000,1000,15 RATE_LIMIT_HEAVY=1000,1000,15 RATE_LIMIT_REFRESH=1000,1000,1 uvicorn main:app
+
+    python -m bench.load --base-url http://127.0.0.1:8000 --concurrency 32 --requests 2000 --output run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+import asyncpg
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Scenario:
+    def __init__(self, name: str, method: str, make_request: Callable, count_rows: Callable = None):
+        self.name = name
+        self.method = method
+        self.make_request = make_request
+        self.count_rows = count_rows or _count_rows
+
+
+def _count_rows(response: httpx.Response, payload: Optional[list]) -> int:
+    body = response.json()
+    if isinstance(body, list):
+        return len(body)
+    return 1
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[position]
+
+
+def _rss_kb(pid: Optional[int]) -> Optional[int]:
+    """VmRSS процесса сервера из /proc (только Linux)"""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", 'r') as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+async def load_fixtures(dsn: str) -> dict:
+    conn = await asyncpg.connect(dsn)
+    try:
+        tokens = await conn.fetch("SELECT token, airline_iata_code FROM tokens WHERE is_active")
+        airports = await conn.fetch("SELECT iata_code FROM airports")
+        bounds = await conn.fetchrow("SELECT MIN(plan_departure) AS lo, MAX(plan_departure) AS hi FROM flights")
+    finally:
+        await conn.close()
+    return {
+        "tokens": [(r["token"], r["airline_iata_code"]) for r in tokens],
+        "airports": [r["iata_code"] for r in airports],
+        "date_from": bounds["lo"] or datetime(2023, 1, 1, tzinfo=timezone.utc),
+        "date_to": bounds["hi"] or datetime(2025, 1, 1, tzinfo=timezone.utc),
+    }
+
+
+def make_upload_batch(rng: random.Random, fixtures: dict, size: int) -> list:
+    span = (fixtures["date_to"] - fixtures["date_from"]).total_seconds()
+    batch = []
+    for _ in range(size):
+        dep, arr = rng.sample(fixtures["airports"], 2)
+        plan_departure = fixtures["date_from"] + timedelta(seconds=rng.uniform(0, span))
+        plan_arrival = plan_departure + timedelta(minutes=rng.randint(45, 520))
+        delay = timedelta(minutes=rng.expovariate(1 / 12))
+        batch.append({
+            "flight": str(rng.randint(100, 9999)),
+            "departure_airport": dep,
+            "arrival_airport": arr,
+            "plan_departure": plan_departure.isoformat(),
+            "plan_arrival": plan_arrival.isoformat(),
+            "fact_departure": (plan_departure + delay).isoformat(),
+            "fact_arrival": (plan_arrival + delay).isoformat(),
+        })
+    return batch
+
+
+def build_scenarios(fixtures: dict, args) -> List[Scenario]:
+    rng = random.Random(args.seed)
+    airports = fixtures["airports"]
+
+    def upload():
+        token, _ = rng.choice(fixtures["tokens"])
+        batch = make_upload_batch(rng, fixtures, args.batch_size)
+        return {
+            "url": "/upload",
+            "json": batch,
+            "headers": {"Authorization": f"Bearer {token}"},
+        }
+
+    def flights():
+        dep = rng.choice(airports)
+        return {"url": "/flights", "params": {"departure_airport": dep, "limit": args.flights_limit}}
+
+    def airport_stats():
+        return {"url": f"/airports/{rng.choice(airports)}/stats"}
+
+    def static(url):
+        return lambda: {"url": url}
+
+    def upload_rows(response, payload):
+        return response.json().get("processed", 0)
+
+    scenarios = [
+        Scenario("upload", "POST", upload, upload_rows),
+        Scenario("flights", "GET", flights),
+        Scenario("airport_stats", "GET", airport_stats),
+        Scenario("get_top3", "GET", static("/get_top3")),
+        Scenario("get_all_direction", "GET", static("/get_all_direction")),
+        Scenario("get_airline_punctuality", "GET", static("/get_airline_punctuality")),
+        Scenario("get_airports", "GET", static("/get_airports")),
+        Scenario("delay_histogram", "GET", static("/delay_histogram")),
+        Scenario("cancellations_distribution", "GET", static("/cancellations_distribution")),
+        Scenario("delay_rules_refresh", "POST", static("/delay-rules/refresh")),
+    ]
+    if args.scenarios:
+        selected = set(args.scenarios.split(","))
+        scenarios = [s for s in scenarios if s.name in selected]
+    return scenarios
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, args) -> dict:
+    """
+    Задержки и пропускная способность считаются только по успешным (2xx) ответам:
+    быстрые отказы лимитов (429/503) учитываются отдельно, иначе они «улучшали» бы p50/p99
+    """
+    latencies, errors, rows, sent = [], 0, 0, 0
+    rejected = {429: 0, 503: 0}
+    remaining = args.requests
+    lock = asyncio.Lock()
+    rss_before = _rss_kb(args.server_pid)
+    rss_peak = rss_before
+
+    async def worker():
+        nonlocal remaining, errors, rows, sent, rss_peak
+        while True:
+            async with lock:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            request = scenario.make_request()
+            started = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, **request)
+                elapsed = time.perf_counter() - started
+                sent += 1
+                if response.status_code in rejected:
+                    rejected[response.status_code] += 1
+                elif response.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(elapsed)
+                    rows += scenario.count_rows(response, request.get("json"))
+            except httpx.HTTPError:
+                sent += 1
+                errors += 1
+            rss = _rss_kb(args.server_pid)
+            if rss is not None:
+                rss_peak = max(rss_peak or 0, rss)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": scenario.name,
+        "sent": sent,
+        "requests": len(latencies),
+        "errors": errors,
+        "rejected": {str(code): count for code, count in rejected.items()},
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "rows": rows,
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p90": round(_percentile(latencies, 90) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        "server_rss_kb": {"before": rss_before, "peak": rss_peak},
+    }
+
+
+async def run(args) -> dict:
+    fixtures = await load_fixtures(args.dsn)
+    scenarios = build_scenarios(fixtures, args)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    headers = {"X-Admin-Secret": os.getenv("ADMIN_SECRET", "default-admin-secret")}
+
+    results = []
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout, headers=headers) as client:
+        for scenario in scenarios:
+            if args.warmup:
+                warmup = argparse.Namespace(**{**vars(args), "requests": args.warmup})
+                await run_scenario(client, scenario, warmup)
+            result = await run_scenario(client, scenario, args)
+            results.append(result)
+            print(
+                f"{result['scenario']:<28} p50={result['latency_ms']['p50']:>8} ms "
+                f"p99={result['latency_ms']['p99']:>8} ms "
+                f"rps={result['requests_per_s']:>8} rows/s={result['rows_per_s']:>10} "
+                f"errors={result['errors']} 429={result['rejected']['429']} 503={result['rejected']['503']}"
+            )
+
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "batch_size": args.batch_size,
+        "python": platform.python_version(),
+        "client_max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--dsn", default=os.getenv('BENCH_DB_DSN', os.getenv('DB_DSN')))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="Запросов на сценарий")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=500, help="Рейсов в одном /upload")
+    parser.add_argument("--flights-limit", type=int, default=100)
+    parser.add_argument("--scenarios", help="Список сценариев через запятую")
+    parser.add_argument("--server-pid", type=int, help="PID сервера для замера RSS")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Путь к JSON-отчёту")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
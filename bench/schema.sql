@@ -0,0 +1,60 @@
+-- Минимальная схема для локальной базы бенчмарков (повторяет таблицы, с которыми работает API)
+
+CREATE TABLE IF NOT EXISTS airlines (
+    iata_code VARCHAR(3) PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS airports (
+    iata_code VARCHAR(3) PRIMARY KEY,
+    airport_name TEXT NOT NULL,
+    city TEXT,
+    country TEXT,
+    timezone TEXT,
+    longitude DOUBLE PRECISION,
+    latitude DOUBLE PRECISION
+);
+
+CREATE TABLE IF NOT EXISTS flights (
+    id BIGSERIAL PRIMARY KEY,
+    iata_code VARCHAR(3) NOT NULL REFERENCES airlines (iata_code),
+    flight VARCHAR(10) NOT NULL,
+    departure_airport VARCHAR(3) NOT NULL,
+    arrival_airport VARCHAR(3) NOT NULL,
+    plan_departure TIMESTAMPTZ NOT NULL,
+    plan_arrival TIMESTAMPTZ NOT NULL,
+    fact_departure TIMESTAMPTZ,
+    fact_arrival TIMESTAMPTZ,
+    content_hash BYTEA
+);
+
+CREATE INDEX IF NOT EXISTS flights_lookup_idx ON flights (iata_code, flight, plan_departure);
+CREATE INDEX IF NOT EXISTS flights_departure_airport_idx ON flights (departure_airport);
+CREATE INDEX IF NOT EXISTS flights_arrival_airport_idx ON flights (arrival_airport);
+CREATE INDEX IF NOT EXISTS flights_plan_departure_idx ON flights (plan_departure);
+
+CREATE TABLE IF NOT EXISTS flight_features (
+    flight_id BIGINT PRIMARY KEY,
+    plan_departure TIMESTAMPTZ NOT NULL,
+    airline_iata_code VARCHAR(3),
+    departure_airport VARCHAR(3),
+    arrival_airport VARCHAR(3),
+    day_of_week TEXT,
+    time_of_day TEXT,
+    season TEXT,
+    delay_category TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    airline_iata_code VARCHAR(3) NOT NULL REFERENCES airlines (iata_code),
+    is_active BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+CREATE TABLE IF NOT EXISTS airline_ratings (
+    id BIGSERIAL PRIMARY KEY,
+    airline_iata_code VARCHAR(3) NOT NULL REFERENCES airlines (iata_code),
+    rating_departure DOUBLE PRECISION,
+    rating_arrival DOUBLE PRECISION,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,169 @@
+"""
+Генерация синтетических данных для бенчмарков: авиакомпании, аэропорты, рейсы и токены.
+
+    python -m bench.seed --dsn postgresql://localhost/punctuality_bench --flights 2000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import string
+import time
+from datetime import date, datetime, time as dt_time, timezone
+from itertools import product
+import asyncpg
+from dotenv import load_dotenv
+from app.features import derive_flight_features_range
+from app.retention import ensure_rollup_table
+from app.idempotency import ensure_upload_tables
+
+load_dotenv()
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), 'schema.sql')
+CHUNK_SIZE = 500_000
+
+CITIES = [
+    'Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань',
+    'Нижний Новгород', 'Челябинск', 'Самара', 'Омск', 'Ростов-на-Дону',
+    'Уфа', 'Красноярск', 'Пермь', 'Воронеж', 'Волгоград', 'Сочи',
+    'Калининград', 'Владивосток', 'Хабаровск', 'Иркутск', 'Мурманск',
+]
+
+TIMEZONES = ['Europe/Moscow', 'Asia/Yekaterinburg', 'Asia/Novosibirsk', 'Asia/Vladivostok']
+
+FLIGHTS_QUERY = """
+    WITH src AS (
+        SELECT
+            g,
+            floor(random() * $3)::int AS airline_idx,
+            floor(random() * $4)::int AS dep_idx,
+            floor(random() * ($4 - 1))::int + 1 AS arr_shift,
+            $5::timestamptz + random() * ($6::timestamptz - $5::timestamptz) AS plan_dep,
+            make_interval(mins => 45 + floor(random() * 480)::int) AS duration,
+            random() AS cancel_roll,
+            -ln(1 - random()) * $8 AS delay_minutes
+        FROM generate_series($9::bigint, $9::bigint + $10 - 1) g
+    )
+    INSERT INTO flights (
+        iata_code, flight,
+        departure_airport, arrival_airport,
+        plan_departure, plan_arrival,
+        fact_departure, fact_arrival
+    )
+    SELECT
+        ($1::text[])[airline_idx + 1],
+        (100 + g % 9000)::text,
+        ($2::text[])[dep_idx + 1],
+        ($2::text[])[(dep_idx + arr_shift) % $4 + 1],
+        plan_dep,
+        plan_dep + duration,
+        CASE WHEN cancel_roll < $7 THEN NULL
+             ELSE plan_dep + make_interval(secs => delay_minutes * 60) END,
+        CASE WHEN cancel_roll < $7 THEN NULL
+             ELSE plan_dep + duration + make_interval(secs => delay_minutes * 60) END
+    FROM src
+"""
+
+
+def make_airlines(count: int, rng: random.Random) -> list:
+    codes = [''.join(p) for p in product(string.ascii_uppercase, repeat=2)]
+    rng.shuffle(codes)
+    return [(code, f"Synthetic Airlines {code}") for code in codes[:count]]
+
+
+def make_airports(count: int, rng: random.Random) -> list:
+    codes = [''.join(p) for p in product(string.ascii_uppercase, repeat=3)]
+    rng.shuffle(codes)
+    return [
+        (
+            code,
+            f"Аэропорт {code}",
+            rng.choice(CITIES),
+            'Россия',
+            rng.choice(TIMEZONES),
+            round(rng.uniform(20.0, 180.0), 6),
+            round(rng.uniform(42.0, 72.0), 6),
+        )
+        for code in codes[:count]
+    ]
+
+
+async def seed(args):
+    rng = random.Random(args.seed)
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        if args.create_schema:
+            with open(SCHEMA_FILE, 'r', encoding='utf-8') as file:
+                await conn.execute(file.read())
+        await ensure_rollup_table(conn)
+        await ensure_upload_tables(conn)
+        if args.truncate:
+            await conn.execute(
+                "TRUNCATE upload_batches, flight_rollups, flight_features, flights, tokens, airline_ratings, airports, airlines RESTART IDENTITY"
+            )
+
+        airlines = make_airlines(args.airlines, rng)
+        airports = make_airports(args.airports, rng)
+        await conn.copy_records_to_table('airlines', records=airlines, columns=['iata_code', 'name'])
+        await conn.copy_records_to_table(
+            'airports', records=airports,
+            columns=['iata_code', 'airport_name', 'city', 'country', 'timezone', 'longitude', 'latitude']
+        )
+        await conn.copy_records_to_table(
+            'tokens',
+            records=[(secrets.token_urlsafe(48), code) for code, _ in airlines],
+            columns=['token', 'airline_iata_code']
+        )
+        await conn.copy_records_to_table(
+            'airline_ratings',
+            records=[(code, round(rng.uniform(80, 99), 1), round(rng.uniform(80, 99), 1)) for code, _ in airlines],
+            columns=['airline_iata_code', 'rating_departure', 'rating_arrival']
+        )
+
+        start = datetime.combine(args.date_from, dt_time.min, tzinfo=timezone.utc)
+        end = datetime.combine(args.date_to, dt_time.min, tzinfo=timezone.utc)
+        airline_codes = [code for code, _ in airlines]
+        airport_codes = [a[0] for a in airports]
+
+        await conn.execute("SELECT setseed($1)", (args.seed % 1000) / 1000)
+        started = time.perf_counter()
+        inserted = 0
+        while inserted < args.flights:
+            size = min(CHUNK_SIZE, args.flights - inserted)
+            await conn.execute(
+                FLIGHTS_QUERY,
+                airline_codes, airport_codes, len(airline_codes), len(airport_codes),
+                start, end, args.cancel_rate, args.mean_delay, inserted, size
+            )
+            inserted += size
+            print(f"Рейсов вставлено: {inserted}/{args.flights}")
+        print(f"Рейсы: {time.perf_counter() - started:.1f} с")
+
+        started = time.perf_counter()
+        features = await derive_flight_features_range(conn, start, end)
+        print(f"flight_features: {features} строк за {time.perf_counter() - started:.1f} с")
+
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заполнение базы бенчмарков синтетическими данными")
+    parser.add_argument("--dsn", default=os.getenv('BENCH_DB_DSN', os.getenv('DB_DSN')))
+    parser.add_argument("--airlines", type=int, default=30)
+    parser.add_argument("--airports", type=int, default=300)
+    parser.add_argument("--flights", type=int, default=1_000_000)
+    parser.add_argument("--date-from", type=date.fromisoformat, default=date(2023, 1, 1))
+    parser.add_argument("--date-to", type=date.fromisoformat, default=date(2025, 1, 1))
+    parser.add_argument("--cancel-rate", type=float, default=0.01)
+    parser.add_argument("--mean-delay", type=float, default=12.0, help="Средняя задержка, минут")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--create-schema", action="store_true")
+    parser.add_argument("--truncate", action="store_true")
+    asyncio.run(seed(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
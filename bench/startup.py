@@ -0,0 +1,95 @@
+"""
+Время импорта и память при старте: каждый модуль импортируется в свежем интерпретаторе.
+
+    python -m bench.startup --repeat 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+# Путь API (то, что грузит каждый воркер uvicorn) и стек анализа отдельно
+TARGETS = ["main", "app.analytics"]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+rss = None
+with open("/proc/self/status") as file:
+    for line in file:
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1])
+heavy = sorted(m for m in ("pandas", "numpy", "scipy", "mlxtend") if m in sys.modules)
+print(json.dumps({{
+    "import_ms": elapsed * 1000,
+    "rss_kb": rss,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "heavy_modules": heavy,
+}}))
+"""
+
+
+def probe(module: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Импорт {module} завершился ошибкой:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(module: str, repeat: int) -> dict:
+    # Первый прогон прогревает кэш байт-кода и файловой системы и не учитывается
+    probe(module)
+    runs = [probe(module) for _ in range(repeat)]
+    times = [run["import_ms"] for run in runs]
+    return {
+        "module": module,
+        "import_ms": {
+            "median": round(statistics.median(times), 1),
+            "min": round(min(times), 1),
+            "max": round(max(times), 1),
+        },
+        "rss_kb": runs[-1]["rss_kb"],
+        "max_rss_kb": runs[-1]["max_rss_kb"],
+        "modules": runs[-1]["modules"],
+        "heavy_modules": runs[-1]["heavy_modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер времени импорта и RSS при старте")
+    parser.add_argument("--modules", help="Список модулей через запятую")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Путь к JSON-отчёту")
+    args = parser.parse_args()
+
+    modules = args.modules.split(",") if args.modules else TARGETS
+    results = []
+    for module in modules:
+        result = measure(module, args.repeat)
+        results.append(result)
+        heavy = ", ".join(result["heavy_modules"]) or "нет"
+        print(
+            f"{module}: импорт {result['import_ms']['median']} мс (медиана), "
+            f"RSS {result['rss_kb']} КБ, модулей {result['modules']}, тяжёлые: {heavy}"
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import argparse
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from DB.Database import db
@@ -5,8 +7,14 @@ from dotenv import load_dotenv
 import os
 import uvicorn
 from app.API_internal import endpoints
-from app.API_external import upload, public
-from utils import calculate_flight_direction, close_db_pool, get_db_pool, calculate_airline_punctuality
+from app.API_external import upload, public, export
+from app.route_graph import route_graph
+from app.airport_index import airport_index, refresh_periodically
+from app.metrics import MetricsMiddleware, registry as metrics_registry, router as metrics_router
+from app.serialization import ORJSONResponse
+from app.broadcast import on_cluster_event
+from app.delay_predictor import rule_matcher
+from app import cluster
 
 load_dotenv()
 
@@ -15,20 +23,29 @@ async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
 
     dsn = os.getenv('DB_DSN')
+    metrics_registry.const_labels["worker"] = cluster.NODE_ID
     await db.connect(dsn)
-    pool = await get_db_pool()
-    await calculate_flight_direction(pool)
-    await calculate_airline_punctuality(pool)
+    cluster.coordinator = cluster.Coordinator(dsn)
+    cluster.coordinator.snapshot_listeners.append(route_graph.schedule_refresh)
+    cluster.coordinator.event_listeners.append(on_cluster_event)
+    await cluster.coordinator.start()
+    await route_graph.refresh_if_stale()
+    rule_matcher.refresh_if_stale()
+    async with db.connection() as conn:
+        await airport_index.load(conn)
+    airports_refresher = asyncio.create_task(refresh_periodically(db.pool))
     yield
 
+    airports_refresher.cancel()
+    await cluster.coordinator.stop()
     await db.disconnect()
-    await close_db_pool(pool)
 
 app = FastAPI(
     title="Punctuality Flight API",
     version="0.1.0",
     openapi_version="3.0.3",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     root_path="/api",
     docs_url="/docs",
     openapi_url="/openapi.json",
@@ -37,6 +54,20 @@ app = FastAPI(
 app.include_router(endpoints.router)
 app.include_router(upload.router)
 app.include_router(public.router)
+app.include_router(export.router)
+app.include_router(metrics_router)
+app.add_middleware(MetricsMiddleware)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    parser = argparse.ArgumentParser(description="Punctuality Flight API")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "1")))
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Воркеры импортируют приложение заново и читают WORKERS из окружения
+        os.environ["WORKERS"] = str(args.workers)
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
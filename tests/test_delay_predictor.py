@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+from app.delay_predictor import DelayRuleMatcher, NO_DELAY, flight_features
+
+
+def rule(antecedents, consequents, confidence, consequent_support="0.1"):
+    return {
+        "antecedents": f"frozenset({set(antecedents)!r})",
+        "consequents": f"frozenset({set(consequents)!r})",
+        "support": "0.01",
+        "confidence": str(confidence),
+        "lift": "1.5",
+        "consequent support": consequent_support,
+        "formatted_rule": "",
+    }
+
+
+def winter_flight(hour: int):
+    return flight_features("SU", "SVO", "LED", datetime(2024, 1, 15, hour, tzinfo=timezone.utc))
+
+
+def test_build_skips_rules_with_feature_items_in_consequent():
+    matcher = DelayRuleMatcher()
+    matcher.build([
+        rule({"season=Зима"}, {"delay_category=Средняя", "time_of_day=Утро"}, 0.3),
+        rule({"season=Зима"}, {"time_of_day=Утро"}, 0.5),
+        rule({"delay_category=Короткая"}, {"season=Зима"}, 0.9),
+    ])
+    assert matcher.rules == []
+    assert matcher.priors == {}
+
+
+def test_score_uses_only_single_category_rules():
+    matcher = DelayRuleMatcher()
+    matcher.build([
+        rule({"season=Зима"}, {"delay_category=Средняя", "time_of_day=Утро"}, 0.3),
+        rule({"season=Зима", "time_of_day=Вечер"}, {"delay_category=Короткая"}, 0.4, "0.2"),
+    ])
+    assert matcher.priors == {"Короткая": 0.2}
+
+    evening = matcher.score(matcher.mask(winter_flight(19)))
+    assert evening["probabilities"]["Средняя"] == 0.0
+    assert evening["probabilities"]["Короткая"] == 0.4
+    assert evening["probabilities"][NO_DELAY] == 0.6
+    assert len(evening["matched"]) == 1
+
+    # Без сработавших правил — априорная частота категории
+    morning = matcher.score(matcher.mask(winter_flight(8)))
+    assert morning["matched"] == []
+    assert morning["probabilities"]["Короткая"] == 0.2
+    assert morning["category"] == NO_DELAY
@@ -1,63 +1,62 @@
-from decimal import Decimal
-import json
 import os
 import aiofiles
 import asyncpg
 from DB.Database import db
-from datetime import datetime
+from app.serialization import dumps
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 
 load_dotenv()
 
-async def get_db():
-    async with db.connection() as conn:
-        yield conn
-        
-def format_datetime(dt: datetime) -> str:
-    return dt.strftime('%Y-%m-%d')
+DIRECTIONS_SNAPSHOT = 'data/flight_direction_stats.json'
+AIRLINES_SNAPSHOT = 'data/airline_punctuality.json'
+SNAPSHOT_FILES = (DIRECTIONS_SNAPSHOT, AIRLINES_SNAPSHOT)
 
-async def get_db_pool():
-    return await asyncpg.create_pool(os.getenv('DB_DSN'))
-
-async def close_db_pool(pool):
-    await pool.close()
-
-async def calculate_flight_direction(pool: asyncpg.pool.Pool):
-    async with pool.acquire() as conn:
-        try:
-            results = await conn.fetch("""
-                WITH DirectionStats AS (
+# Источник — горячие рейсы плюс свёртки архивированных месяцев (app/retention.py)
+DIRECTION_STATS_QUERY = """
+            WITH Source AS (
                 SELECT 
-                    LEAST(f.departure_airport, f.arrival_airport) AS airport1,
-                    GREATEST(f.departure_airport, f.arrival_airport) AS airport2,
-                    COUNT(*) AS total_flights,
-                    SUM(
-                        CASE 
-                            WHEN f.fact_arrival IS NOT NULL 
-                                AND ABS(EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival))) < 900 
-                            THEN 1 
-                            ELSE 0 
-                        END
-                    ) AS on_time_arrivals,
-                    ROUND(AVG(
-                        CASE 
-                            WHEN f.fact_arrival IS NOT NULL 
-                            THEN EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival))/60 
-                            ELSE NULL
-                        END
-                    )::numeric, 1) AS avg_delay_minutes,
-                    SUM(
-                        CASE 
-                            WHEN f.fact_departure IS NULL 
-                            THEN 1 
-                            ELSE 0 
-                        END
-                    ) AS missing_departure_count
+                    f.departure_airport,
+                    f.arrival_airport,
+                    1 AS total_flights,
+                    CASE 
+                        WHEN f.fact_arrival IS NOT NULL 
+                            AND ABS(EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival))) < 900 
+                        THEN 1 
+                        ELSE 0 
+                    END AS on_time_arrivals,
+                    EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival))/60 AS delay_minutes_sum,
+                    CASE WHEN f.fact_arrival IS NOT NULL THEN 1 ELSE 0 END AS delay_count,
+                    CASE WHEN f.fact_departure IS NULL THEN 1 ELSE 0 END AS missing_departure_count
                 FROM flights f
+                {where}
+                UNION ALL
+                SELECT 
+                    f.departure_airport,
+                    f.arrival_airport,
+                    f.total_flights,
+                    f.on_time_arrivals_abs,
+                    f.arrival_delay_minutes_sum,
+                    f.arrival_delay_count,
+                    f.cancellations
+                FROM flight_rollups f
+                {rollup_where}
+            ),
+            DirectionStats AS (
+                SELECT 
+                    LEAST(departure_airport, arrival_airport) AS airport1,
+                    GREATEST(departure_airport, arrival_airport) AS airport2,
+                    SUM(total_flights)::BIGINT AS total_flights,
+                    SUM(on_time_arrivals)::BIGINT AS on_time_arrivals,
+                    ROUND(
+                        (SUM(delay_minutes_sum) / NULLIF(SUM(delay_count), 0))::numeric, 
+                        1
+                    ) AS avg_delay_minutes,
+                    SUM(missing_departure_count)::BIGINT AS missing_departure_count
+                FROM Source
                 GROUP BY 
-                    LEAST(f.departure_airport, f.arrival_airport), 
-                    GREATEST(f.departure_airport, f.arrival_airport)
+                    LEAST(departure_airport, arrival_airport), 
+                    GREATEST(departure_airport, arrival_airport)
             )
             SELECT 
                 airport1,
@@ -71,56 +70,48 @@ async def calculate_flight_direction(pool: asyncpg.pool.Pool):
                 COALESCE(avg_delay_minutes, 0) AS avg_delay_minutes,
                 missing_departure_count
             FROM DirectionStats
-            ORDER BY airport1, airport2;
-                                    """)
-            
-            def convert_value(value):
-                    if isinstance(value, datetime):
-                        return value.isoformat()
-                    if isinstance(value, Decimal):
-                        return float(value)
-                    return value
-                
-            data = [
-                {k: convert_value(v) for k, v in record.items()}
-                for record in results
-            ]
-            
-            async with aiofiles.open('data//flight_direction_stats.json', 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(data, ensure_ascii=False, indent=2))
-            return True
-        except Exception as e:
-            print(f"Error in calculate_flight_direction: {e}")
-            return False
+            ORDER BY airport1, airport2
+"""
 
-async def calculate_airline_punctuality(pool: asyncpg.pool.Pool):
-    async with pool.acquire() as conn:
-        try:
-            os.makedirs('data', exist_ok=True)
-            
-            results = await conn.fetch("""
-                WITH FlightStats AS (
+AIRLINE_PUNCTUALITY_QUERY = """
+                WITH Source AS (
                     SELECT
-                        f.iata_code AS code,
-                        a.name AS airline,
-                        COUNT(*) AS total_flights,
-                        COUNT(CASE 
-                                WHEN f.fact_departure IS NOT NULL 
-                                AND EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) < 900 
-                                THEN 1 
-                            END) AS on_time_departures,
-                        COUNT(CASE 
-                                WHEN f.fact_arrival IS NOT NULL 
-                                AND EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival)) < 900 
-                                THEN 1 
-                            END) AS on_time_arrivals,
-                        COUNT(CASE 
-                                WHEN f.fact_departure IS NULL 
-                                THEN 1 
-                            END) AS cancellations
+                        f.iata_code,
+                        1 AS total_flights,
+                        CASE 
+                            WHEN f.fact_departure IS NOT NULL 
+                            AND EXTRACT(EPOCH FROM (f.fact_departure - f.plan_departure)) < 900 
+                            THEN 1 ELSE 0
+                        END AS on_time_departures,
+                        CASE 
+                            WHEN f.fact_arrival IS NOT NULL 
+                            AND EXTRACT(EPOCH FROM (f.fact_arrival - f.plan_arrival)) < 900 
+                            THEN 1 ELSE 0
+                        END AS on_time_arrivals,
+                        CASE WHEN f.fact_departure IS NULL THEN 1 ELSE 0 END AS cancellations
                     FROM flights f
-                    LEFT JOIN airlines a ON f.iata_code = a.iata_code
-                    GROUP BY f.iata_code, a.name
+                    {where}
+                    UNION ALL
+                    SELECT
+                        f.iata_code,
+                        f.total_flights,
+                        f.on_time_departures,
+                        f.on_time_arrivals,
+                        f.cancellations
+                    FROM flight_rollups f
+                    {rollup_where}
+                ),
+                FlightStats AS (
+                    SELECT
+                        s.iata_code AS code,
+                        a.name AS airline,
+                        SUM(s.total_flights)::BIGINT AS total_flights,
+                        SUM(s.on_time_departures)::BIGINT AS on_time_departures,
+                        SUM(s.on_time_arrivals)::BIGINT AS on_time_arrivals,
+                        SUM(s.cancellations)::BIGINT AS cancellations
+                    FROM Source s
+                    LEFT JOIN airlines a ON s.iata_code = a.iata_code
+                    GROUP BY s.iata_code, a.name
                 )
                 SELECT
                     code,
@@ -140,29 +131,85 @@ async def calculate_airline_punctuality(pool: asyncpg.pool.Pool):
                     )::FLOAT AS cancellation_percentage
                 FROM FlightStats
                 ORDER BY (on_time_departures * 100.0 / NULLIF(total_flights, 0)) DESC, 
-                         (on_time_arrivals * 100.0 / NULLIF(total_flights, 0)) DESC;
-            """)
+                         (on_time_arrivals * 100.0 / NULLIF(total_flights, 0)) DESC
+"""
+
+def format_airline_punctuality(results):
+    return [
+        {
+            "Код": record["code"],
+            "Авиакомпания": record["airline"],
+            "Отправление": record["departure_percentage"],
+            "Прибытие": record["arrival_percentage"],
+            "Отмены": record["cancellation_percentage"],
+            "Количество рейсов": record["total_flights"]
+        }
+        for record in results
+    ]
+
+async def get_db():
+    async with db.connection() as conn:
+        yield conn
+        
+async def write_snapshot(path: str, content: bytes):
+    """Атомарная запись снимка: читатели видят либо старый, либо новый файл целиком"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    async with aiofiles.open(tmp_path, 'wb') as f:
+        await f.write(content)
+    os.replace(tmp_path, path)
+
+async def calculate_flight_direction(pool: asyncpg.pool.Pool):
+    async with pool.acquire() as conn:
+        try:
+            results = await conn.fetch(DIRECTION_STATS_QUERY.format(where="", rollup_where=""))
+            
+            await write_snapshot(DIRECTIONS_SNAPSHOT, dumps(results, indent=True))
+            return True
+        except Exception as e:
+            print(f"Error in calculate_flight_direction: {e}")
+            return False
+
+async def calculate_airline_punctuality(pool: asyncpg.pool.Pool):
+    async with pool.acquire() as conn:
+        try:
+            os.makedirs('data', exist_ok=True)
             
-            data = [
-                {
-                    "Код": record["code"],
-                    "Авиакомпания": record["airline"],
-                    "Отправление": record["departure_percentage"],
-                    "Прибытие": record["arrival_percentage"],
-                    "Отмены": record["cancellation_percentage"],
-                    "Количество рейсов": record["total_flights"]
-                }
-                for record in results
-            ]
+            results = await conn.fetch(AIRLINE_PUNCTUALITY_QUERY.format(where="", rollup_where=""))
             
-            async with aiofiles.open('data/airline_punctuality.json', 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+            data = format_airline_punctuality(results)
+            
+            await write_snapshot(AIRLINES_SNAPSHOT, dumps(data, indent=True))
             return True
         except Exception as e:
             print(f"Error in calculate_airline_punctuality: {e}")
             return False
 
 
+async def fetch_upload_deltas(conn, airline_code: str, directions):
+    """Агрегаты авиакомпании и затронутых направлений после загрузки"""
+    pairs = {tuple(sorted(pair)) for pair in directions}
+    airline_filter = "WHERE f.iata_code = $1"
+    airline = await conn.fetch(
+        AIRLINE_PUNCTUALITY_QUERY.format(where=airline_filter, rollup_where=airline_filter),
+        airline_code
+    )
+    direction_filter = """
+                WHERE (LEAST(f.departure_airport, f.arrival_airport),
+                       GREATEST(f.departure_airport, f.arrival_airport))
+                    IN (SELECT * FROM unnest($1::text[], $2::text[]))
+    """
+    direction_rows = await conn.fetch(
+        DIRECTION_STATS_QUERY.format(where=direction_filter, rollup_where=direction_filter),
+        [a for a, _ in pairs],
+        [b for _, b in pairs]
+    )
+    return {
+        "airline": format_airline_punctuality(airline),
+        "directions": direction_rows,
+    }
+
+
 @asynccontextmanager
 async def get_db_connection():
     conn = await asyncpg.connect(os.getenv('DB_DSN'))